@@ -0,0 +1,96 @@
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+#=========================
+#  LRU cache
+#=========================
+
+_missing = object()
+
+class LRUCache(object):
+    '''In-process, thread-safe LRU cache, bounded in number of items and/or total size (in bytes), with optional TTL (in seconds)'''
+
+    def __init__(self, max_items=None, max_bytes=None, ttl=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self._items = OrderedDict() # key -> (value, size, expires)
+        self._lock = threading.RLock()
+        self._create_locks = {} # key -> [lock, users], for the items being created
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def _pop(self, key):
+        _, size, _ = self._items.pop(key)
+        self.bytes -= size
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key, None)
+            if item is None:
+                return default
+            if item[2] is not None and item[2] < time.time():
+                self._pop(key)
+                return default
+            self._items.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value, size=0):
+        # Do not even try to cache items bigger than the whole cache
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._pop(key)
+            self._items[key] = (value, size, time.time() + self.ttl if self.ttl else None)
+            self.bytes += size
+            while (self.max_items is not None and len(self._items) > self.max_items) or (self.max_bytes is not None and self.bytes > self.max_bytes):
+                self._pop(next(iter(self._items)))
+
+    def get_or_set(self, key, create, sizeof=None):
+        '''Get an item, or create and set it if missing. Creation is serialized per key, so that concurrent misses on the same
+        key create it only once, while misses on different keys do not wait for each other.'''
+        value = self.get(key, _missing)
+        if value is _missing:
+            with self._lock:
+                create_lock = self._create_locks.setdefault(key, [threading.RLock(), 0]) # Re-entrant, as items can be created out of other items
+                create_lock[1] += 1
+            try:
+                with create_lock[0]:
+                    value = self.get(key, _missing)
+                    if value is _missing:
+                        value = create()
+                        self.set(key, value, sizeof(value) if sizeof else 0)
+            finally:
+                with self._lock:
+                    create_lock[1] -= 1
+                    if not create_lock[1]:
+                        del self._create_locks[key]
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._items:
+                self._pop(key)
+
+    def delete_if(self, condition):
+        '''Delete all the items whose key satisfies the given condition'''
+        with self._lock:
+            for key in [key for key in self._items if condition(key)]:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
@@ -2,8 +2,12 @@
 # Django imports
 from rest_framework import status
 from rest_framework.response import Response
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse
+from django.conf import settings
 import json
+import hmac
+import hashlib
+from .cache import LRUCache
 
 
 #==============================
@@ -60,7 +64,43 @@ def error500rest(caller=None, error_msg=None):
 # Thing common returns (encryption support)
 #===========================================
 
-def response(payload, status=None, caller=None, raw=False):
+# Encrypted payloads, by cache key as given by the callers (i.e. session token, session key and content validator)
+encrypted_payloads_cache = LRUCache(max_bytes=settings.ENCRYPTED_PAYLOADS_CACHE_MAX_BYTES, ttl=settings.ENCRYPTED_PAYLOADS_CACHE_TTL)
+
+def _cached_stream(stream, cache_key):
+    # Only a fully streamed text gets cached: if the Thing goes away the generator is just closed, and the
+    # encryption is not completed on the request path (the retry will stream and cache it)
+    parts = []
+    for part in stream:
+        parts.append(part)
+        yield part
+    encrypted_text = ''.join(parts)
+    encrypted_payloads_cache.set(cache_key, encrypted_text, len(encrypted_text))
+
+def encrypted_response(payload_encrypter, text, status=None, cache_key=None):
+    '''Encrypt a text into an HttpResponse or, if big enough and supported by the encrypter, into a StreamingHttpResponse,
+    so that the Thing starts receiving it while it is still being encrypted (and without ever holding it all encrypted).
+    If a cache key is given, the encrypted text is cached and served from the cache on the next requests.'''
+    if cache_key is not None:
+        encrypted_text = encrypted_payloads_cache.get(cache_key)
+        if encrypted_text is not None:
+            return HttpResponse(encrypted_text, status=status)
+    if len(text) > settings.STREAMING_RESPONSE_MIN_SIZE and hasattr(payload_encrypter, 'encrypt_text_stream'):
+        stream = payload_encrypter.encrypt_text_stream(text, settings.STREAMING_RESPONSE_CHUNK_BLOCKS)
+        if cache_key is not None:
+            stream = _cached_stream(stream, cache_key)
+        response_obj = StreamingHttpResponse(stream, status=status)
+        encrypted_length = payload_encrypter.encrypted_length(text)
+        if encrypted_length is not None:
+            response_obj['Content-Length'] = str(encrypted_length)
+        return response_obj
+    else:
+        encrypted_text = payload_encrypter.encrypt_text(text)
+        if cache_key is not None:
+            encrypted_payloads_cache.set(cache_key, encrypted_text, len(encrypted_text))
+        return HttpResponse(encrypted_text, status=status)
+
+def response(payload, status=None, caller=None, raw=False, cache_key=None):
     #logger.debug(' ** OUT ** - Preparing payload {}'.format(payload))
     if caller and caller.payload_encrypter:
         payload_encrypter = caller.payload_encrypter
@@ -69,16 +109,19 @@ def response(payload, status=None, caller=None, raw=False):
     
     if payload_encrypter:
         
-        if raw:     
+        if caller.raw_body:
+            # Raw-body (binary) framing, as the request
+            payload = payload_encrypter.encrypt_bytes((str(payload) if raw else json.dumps(payload)).encode('utf-8'))
+            return HttpResponse(payload, status=status, content_type='application/octet-stream')
+
+        elif raw:     
             # Payload must be string
-            payload = payload_encrypter.encrypt_text(str(payload))
             #logger.debug(' ** OUT ** - Returning encypted payload: {}'.format(payload))
-            return HttpResponse(payload, status=status)
+            return encrypted_response(payload_encrypter, str(payload), status=status, cache_key=cache_key)
         else:
             # Payload must be JSON-serializable object
-            payload = payload_encrypter.encrypt_text(json.dumps(payload))
             #logger.debug(' ** OUT ** - Returning encypted payload: {}'.format(payload))
-            return HttpResponse(payload, status=status)
+            return encrypted_response(payload_encrypter, json.dumps(payload), status=status, cache_key=cache_key)
 
     else:
         
@@ -90,11 +133,59 @@ def response(payload, status=None, caller=None, raw=False):
             return Response(payload, status=status)
 
 # Ok (with data)
-def ok200thing(caller=None, data=None, raw=False):
+def ok200thing(caller=None, data=None, raw=False, etag=None, cache_key=None):
     if raw:
-        return response(data, status.HTTP_200_OK, caller, raw=True)
+        response_obj = response(data, status.HTTP_200_OK, caller, raw=True, cache_key=cache_key)
     else:
-        return response(data, status.HTTP_200_OK, caller)
+        response_obj = response(data, status.HTTP_200_OK, caller, cache_key=cache_key)
+    if etag:
+        response_obj['ETag'] = '"{}"'.format(etag)
+    return response_obj
+
+# Ok (with zlib-compressed data, never encrypted)
+def ok200thingdeflated(caller=None, data=None, etag=None):
+    response_obj = HttpResponse(data, status=status.HTTP_200_OK)
+    response_obj['Content-Encoding'] = 'deflate'
+    if etag:
+        response_obj['ETag'] = '"{}"'.format(etag)
+    return response_obj
+
+# Ok (with a file, handed off to the web server if configured, otherwise streamed via the WSGI file wrapper i.e. sendfile)
+def file200thing(caller=None, file_path=None, etag=None):
+    if settings.SENDFILE_HEADER:
+        response_obj = HttpResponse(status=status.HTTP_200_OK)
+        response_obj[settings.SENDFILE_HEADER] = settings.SENDFILE_PREFIX + file_path
+    else:
+        response_obj = FileResponse(open(file_path, 'rb'), status=status.HTTP_200_OK)
+    if etag:
+        response_obj['ETag'] = '"{}"'.format(etag)
+    return response_obj
+
+# Partial content (with a chunk of the data and its hash)
+def range_unit(caller=None):
+    # Encrypted payloads are text-based, hence their ranges are in characters of the plaintext, not bytes
+    return 'chars' if caller and caller.payload_encrypter else 'bytes'
+
+def partial206thing(caller=None, data=None, start=None, end=None, etag=None, cache_key=None):
+    chunk = data[start:end]
+    chunk_data = chunk if isinstance(chunk, bytes) else chunk.encode('utf-8')
+    response_obj = response(chunk, status.HTTP_206_PARTIAL_CONTENT, caller, raw=True, cache_key=cache_key+(start, end) if cache_key else None)
+    response_obj['Content-Range'] = '{} {}-{}/{}'.format(range_unit(caller), start, end-1, len(data))
+    if caller and caller.payload_encrypter:
+        # Do not send the hash of the plaintext in the clear: bind it to the session key
+        response_obj['X-Chunk-HMAC-SHA256'] = hmac.new(str(caller.session_key).encode('utf-8'), chunk_data, hashlib.sha256).hexdigest()
+    else:
+        response_obj['X-Chunk-SHA256'] = hashlib.sha256(chunk_data).hexdigest()
+    if etag:
+        response_obj['ETag'] = '"{}"'.format(etag)
+    return response_obj
+
+# Not modified (no data)
+def notmodified304thing(caller=None, etag=None):
+    response_obj = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    if etag:
+        response_obj['ETag'] = '"{}"'.format(etag)
+    return response_obj
 
 # Error 400
 def error400thing(caller=None, error_msg=None):
@@ -108,6 +199,12 @@ def error401thing(caller=None, error_msg=None):
 def error404thing(caller=None, error_msg=None):
     return response(error_msg, status.HTTP_404_NOT_FOUND, caller)
 
+# Error 416 (range not satisfiable)
+def error416thing(caller=None, total=None):
+    response_obj = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+    response_obj['Content-Range'] = '{} */{}'.format(range_unit(caller), total)
+    return response_obj
+
 # Error 500
 def error500thing(caller=None, error_msg=None):
     return response(error_msg, status.HTTP_500_INTERNAL_SERVER_ERROR, caller)
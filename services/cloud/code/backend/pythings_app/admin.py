@@ -7,9 +7,12 @@ admin.site.register(App)
 admin.site.register(Session)
 admin.site.register(Settings)
 admin.site.register(Pool)
+admin.site.register(Rollout)
+admin.site.register(Blob)
 admin.site.register(File)
 admin.site.register(Commit)
 admin.site.register(Profile)
 admin.site.register(WorkerMessage)
 admin.site.register(ManagementMessage)
+admin.site.register(ManagementMessageHistory)
 admin.site.register(MessageCounter)
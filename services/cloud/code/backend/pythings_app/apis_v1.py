@@ -1,4 +1,6 @@
 import json
+import hmac
+import hashlib
 import logging
 import uuid
 import time
@@ -8,22 +10,26 @@ import re
 from django.http import HttpResponse
 from django.utils import timezone
 from django.core.exceptions import MultipleObjectsReturned
+from django.db.models import Q
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.parsers import BaseParser
+from rest_framework.settings import api_settings
 
 # Backend imports
 from ..common.utils import format_exception
 from ..common.time import dt_from_s
-from ..common.returns import ok200thing, error400thing, error401thing, error404thing, error500thing
+from ..common.returns import range_unit, ok200thing, ok200thingdeflated, file200thing, partial206thing, notmodified304thing, error416thing, error400thing, error401thing, error404thing, error500thing
 from .models import WorkerMessageHandler, ManagementMessage, App, Thing, Session, Pool, Commit
-from .helpers import get_total_messages, get_total_devices, inc_total_messages, create_app, settings_to_dict
+from .payloads import get_app_payload, get_app_manifest, diff_app_manifest, get_app_bundle
+from .dist import dist_index, DistFileChanged
+from .helpers import get_total_messages, get_total_devices, inc_total_messages, create_app, settings_to_dict, archive_management_messages, notify_shell, get_next_poll_s, get_rollout_app_version, get_session_encrypter, invalidate_session_encrypter, decrypt_preregistration_key
 
 # Crypto PoC imports
-from .crypto_rsa import Srsa
-from .crypto_aes import Aes128ecb
+from .crypto_aes_gcm import Aes128gcm, InvalidTag, available as aes_gcm_available
 
 # Setup Logging
 logger = logging.getLogger(__name__)
@@ -35,9 +41,21 @@ logger = logging.getLogger(__name__)
 #=========================
 #  Base Thing API class
 #=========================
+class EncryptedBodyParser(BaseParser):
+    '''Parser for the raw-body encrypted requests ("application/octet-stream"), with the token in the X-Pythings-Token header'''
+    media_type = 'application/octet-stream'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        return {'token': request.META.get('HTTP_X_PYTHINGS_TOKEN', None),
+                'encrypted': stream.read() if stream else None}
+
+
 class ThingAPI(APIView):
     '''Base Thing API class'''
 
+    parser_classes = list(api_settings.DEFAULT_PARSER_CLASSES) + [EncryptedBodyParser]
+
     def post(self, request):
         try:
             # Can we handle the data?
@@ -50,8 +68,11 @@ class ThingAPI(APIView):
             
             # logger.debug(' ** IN ** - Received data: {}'.format(request.data))
             self.payload_encrypter = None
+            self.session_token = None
+            self.session_key = None
+            self.raw_body = False
             
-            # Handle the case of encrypted data
+            # Handle the case of encrypted data (raw-body encrypted data is parsed as bytes)
             encrypted = request.data.get('encrypted', None)
             if encrypted:
                 token = request.data.get('token', None)
@@ -68,11 +89,26 @@ class ThingAPI(APIView):
                     session = sessions[0]
                 
                 # Set crypto engine            
-                aes128ecb = Aes128ecb(key=int(session.key), comp_mode=True)
-                self.payload_encrypter = aes128ecb
+                encrypter = get_session_encrypter(session.token, session.key, session.ken)
+                self.payload_encrypter = encrypter
+                self.session_token = session.token
+                self.session_key = session.key
                 
-                # Decrypt data
-                data = aes128ecb.decrypt_text(str(encrypted))
+                # Decrypt data. Raw-body requests get raw-body responses, and are supported by the GCM sessions only.
+                if isinstance(encrypted, bytes):
+                    if not isinstance(encrypter, Aes128gcm):
+                        self.payload_encrypter = None
+                        return error400thing(caller=None, error_msg='Hi, Pythings Cloud here. Error: raw-body encrypted data is not supported for this session.')
+                    self.raw_body = True
+                try:
+                    if self.raw_body:
+                        data = encrypter.decrypt_bytes(encrypted).decode('utf-8')
+                    else:
+                        data = encrypter.decrypt_text(str(encrypted))
+                except (InvalidTag, ValueError):
+                    # Tampered, truncated or not properly framed data (or wrong key)
+                    self.payload_encrypter = None
+                    return error400thing(caller=None, error_msg='Hi, Pythings Cloud here. Error: cannot decrypt the data.')
                 
                 # Convert to dict
                 logger.info('Token="{}"; Decrypted data : "{}"'.format(token, data))
@@ -89,6 +125,10 @@ class ThingAPI(APIView):
 
     def get(self, request):
         try:
+            self.payload_encrypter = None
+            self.session_token = None
+            self.session_key = None
+            self.raw_body = False
 
             # TODO: Do we want payload-encrypted GETs?
             # logger.debug(' ** IN ** - Received data: {}'.format(request.data))
@@ -117,6 +157,93 @@ class ThingAPI(APIView):
     def log(self, level, msg, *strings):
         logger.log(level, self.__class__.__name__ + ': ' + msg, *strings)
 
+    def etag(self, validator):
+        '''Get the (strong) ETag for a validator. For encrypted payloads, it is made opaque and bound to the session key,
+        so that it does not leak the content it refers to.'''
+        if self.session_key:
+            return hmac.new(str(self.session_key).encode('utf-8'), validator.encode('utf-8'), hashlib.sha256).hexdigest()[0:16]
+        else:
+            return validator
+
+    def not_modified(self, request, etag):
+        '''Check if the Thing already has the content for the given ETag, as per the If-None-Match header or,
+        for encrypted payloads (where headers cannot be used), as per the "etag" field of the payload.'''
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH', None)
+        if if_none_match:
+            if if_none_match.strip() == '*':
+                return True
+            for tag in if_none_match.split(','):
+                tag = tag.strip()
+                if tag.startswith('W/'):
+                    tag = tag[2:]
+                if tag.strip('"') == etag:
+                    return True
+            return False
+        if request.method == 'POST':
+            return request.data.get('etag', None) == etag
+        return False
+
+    def accepts_deflate(self, request, thing):
+        '''Check if the Thing can inflate zlib-compressed payloads, as per its capabilities or the Accept-Encoding header.
+        Encrypted payloads are text-based and are therefore never compressed.'''
+        if self.payload_encrypter:
+            return False
+        if thing.capabilities and 'zlib' in re.split('[,; ]+', thing.capabilities):
+            return True
+        for encoding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+            encoding = [item.strip() for item in encoding.split(';')]
+            if encoding[0] == 'deflate':
+                return 'q=0' not in encoding[1:] and 'q=0.0' not in encoding[1:]
+        return False
+
+    def requested_range(self, request, total):
+        '''Get the requested range as (start, end), end excluded, from the Range header or the offset/length fields of
+        the payload. Returns None if no range was requested, and raises ValueError if the range cannot be satisfied.'''
+        if request.method == 'POST' and (request.data.get('offset', None) is not None or request.data.get('length', None) is not None):
+            start = int(request.data.get('offset', None) or 0)
+            length = request.data.get('length', None)
+            end = min(start + int(length), total) if length is not None else total
+        else:
+            # Only single ranges in our unit are supported, otherwise the whole content is sent as allowed by RFC 7233
+            match = re.match(r'^{}=(\d*)-(\d*)$'.format(range_unit(self)), request.META.get('HTTP_RANGE', '').strip())
+            if not match or match.groups() == ('', ''):
+                return None
+            if not match.group(1):
+                # Suffix range (last N bytes)
+                start, end = max(total - int(match.group(2)), 0), total
+            else:
+                start = int(match.group(1))
+                end = min(int(match.group(2)) + 1, total) if match.group(2) else total
+        if start < 0 or start >= end:
+            raise ValueError('Unsatisfiable range')
+        return start, end
+
+    def payload_response(self, request, thing, payload, identity, validator):
+        '''Reply with a (cached) payload, taking care of ETags, compression and ranges. Ranges are in bytes, or in
+        characters ("chars" unit) for encrypted payloads (which are text-based), and ranged replies carry the hash
+        of their chunk, or its HMAC with the session key for encrypted payloads.'''
+        data = payload.content if self.payload_encrypter else payload.data
+        try:
+            byte_range = self.requested_range(request, len(data))
+        except ValueError:
+            return error416thing(caller=self, total=len(data))
+        deflate = not byte_range and self.accepts_deflate(request, thing)
+        etag = self.etag(validator+'-z' if deflate else validator)
+        # Encrypted payloads are cached per session and payload identity (as the validators of different payloads can
+        # match, i.e. same-size dist files), so that retried downloads do not have to encrypt them again
+        cache_key = (self.session_token, self.session_key, identity, validator) if self.payload_encrypter else None
+        if self.not_modified(request, etag):
+            response = notmodified304thing(caller=self, etag=etag)
+        elif byte_range:
+            response = partial206thing(caller=self, data=data, start=byte_range[0], end=byte_range[1], etag=etag, cache_key=cache_key)
+        elif deflate:
+            response = ok200thingdeflated(caller=self, data=payload.deflated, etag=etag)
+        else:
+            response = ok200thing(caller=self, data=payload.content, raw=True, etag=etag, cache_key=cache_key)
+            response['Accept-Ranges'] = range_unit(self)
+        response['Vary'] = 'Accept-Encoding'
+        return response
+
 
 #=========================
 #  Time epoch API
@@ -235,30 +362,40 @@ class api_apps_management(ThingAPI):
 
         # Load settings for this thing
         if thing.use_custom_settings and thing.settings:
-            settings_dict = settings_to_dict(thing.settings)
+            thing_settings = thing.settings
         else:
-            settings_dict = settings_to_dict(thing.pool.settings)
+            thing_settings = thing.pool.settings
+        settings_dict = settings_to_dict(thing_settings)
             
         settings_dict['pool'] = thing.pool.name
 
+        # App version as per the rollout in progress, if any
+        settings_dict['app_version'] = get_rollout_app_version(thing, settings_dict['app_version'], running_version=sessions[0].app_version)
+
         # If management task is up:
         if sessions[0].last_management_status.startswith('OK'):
     
-            # Get queued managemtn messages
-            queued_management_messages = ManagementMessage.objects.filter(tid=thing.tid, status='Queued').order_by('ts')
+            # Get the first queued and not expired management message (expired ones are moved away by the expire command)
+            msg_to_deliver = ManagementMessage.objects.filter(Q(expires__isnull=True) | Q(expires__gt=timezone.now()),
+                                                              tid=thing.tid, status='Queued').order_by('ts').first()
     
-            if len(queued_management_messages) > 0:
-                # Deliver the first one
-                msg_to_deliver = queued_management_messages[0]
+            if msg_to_deliver:
+                # Deliver it
                 msg            = msg_to_deliver.data
                 mid            = msg_to_deliver.uuid
                 management_message={'settings': settings_dict, 'msg': msg, 'mid':mid, 'type':msg_to_deliver.type}
                 msg_to_deliver.status='Delivered'
                 msg_to_deliver.save()
+                notify_shell(msg_to_deliver)
             else:
                 management_message={'settings': settings_dict}
         else:
             management_message={'settings': settings_dict}
+
+        # Hint for when to poll next (as soon as possible if we just delivered a message, as a reply and more may follow)
+        next_poll_s = get_next_poll_s(thing, thing_settings, pending='mid' in management_message)
+        if next_poll_s is not None:
+            management_message['next_poll_s'] = next_poll_s
             
         logger.info('Sending management info to TID={}'.format(thing.tid))
         return ok200thing(caller=self, data=management_message)
@@ -280,10 +417,18 @@ class api_apps_get(ThingAPI):
         version   = request.data.get('version', None)
         list      = request.data.get('list', False)
         file_name = request.data.get('file_name', None)
+        bundle    = request.data.get('bundle', False)
+        
+        # Manifest (for delta updates): files the Thing already has (name -> content hash), or the version it is running
+        manifest     = request.data.get('manifest', False)
+        have         = request.data.get('have', None)
+        from_version = request.data.get('from_version', None)
         
         # Sanity checks
         if not token:
             return error400thing(caller=self, error_msg='Hi, Pythings Cloud here. Sorry, but I got an empty "token".')     
+        if have is not None and not isinstance(have, dict):
+            return error400thing(caller=self, error_msg='Hi, Pythings Cloud here. Sorry, but "have" must be a map of file names to content hashes.')     
 
         # Try to get a session for this thing, and delete it if exists
         sessions = Session.objects.filter(token=token, active=True)
@@ -300,8 +445,21 @@ class api_apps_get(ThingAPI):
             files_list=[]
     
             # Get the commit #TOOD: fixme! cannot use thisa hybrid approach with timestamps and epoches..   
-            commit = Commit.objects.get(app=thing.app, cid=version)
-    
+            try:
+                commit = Commit.objects.get(app=thing.app, cid=version)
+            except Commit.DoesNotExist:
+                return error404thing(caller=self, error_msg='No commit found for the specified version')
+
+            if manifest or have is not None or from_version:
+                # Return the manifest, only with the files changed with respect to what the Thing already has
+                if from_version:
+                    try:
+                        from_commit = Commit.objects.get(app=thing.app, cid=from_version)
+                    except Commit.DoesNotExist:
+                        return error404thing(caller=self, error_msg='No commit found for the specified "from_version"')
+                    have = {entry['name']: entry['content_hash'] for entry in get_app_manifest(from_commit)}
+                files, removed = diff_app_manifest(get_app_manifest(commit), have or {})
+                return ok200thing(caller=self, data={'version': commit.cid, 'files': files, 'removed': removed})
           
             for file in commit.files.all():
                 files_list.append(file.name)
@@ -319,55 +477,28 @@ class api_apps_get(ThingAPI):
     
             # Get the file for the required version
             try:
-                if file_name:
-                    
-                    # New Behavior
+                if bundle:
+
+                    # All the files (with logger and sensors prologue) in a single download, with a manifest header
+                    payload = get_app_bundle(commit)
+
+                    logger.info('Sending application bundle to TID={}'.format(thing.tid))
+                    return self.payload_response(request, thing, payload, (commit.id, None, 'bundle'), '{}-{}'.format(commit.cid, payload.hash))
+
+                elif file_name:
                     
-                    # Extra: logger and sensors
-                    content  = 'import logger\n'
-                    if 'worker' in file_name:
-                        content += 'try:\n'
-                        content += '    import sensors\n'
-                        content += 'except ImportError:\n'
-                        content += '    pass\n\n'
-                        
-                    # Get proper file
-                    for file in commit.files.all():
-                        if file.name == file_name:
-
-                            # Handle binary data
-                            #if file.is_binary():
-                            #    
-                            #    # Open real file and set real content 
-                            #    with open (file.content, 'rb') as f:
-                            #        content = f.read()
-                            #        # To base 64
-                            #        import base64
-                            #        content = base64.encodestring(content)       
-                            #else:
-                            
-                            # Load file content
-                            content += file.content
-                            
-                            # Include also app version
-                            content += '\nversion=\'{}\''.format(commit.cid)
+                    # New Behavior (with logger and sensors prologue)
+                    payload = get_app_payload(commit, file_name)
         
                     logger.info('Sending file "{}" code  to TID={}'.format(file_name, thing.tid))
-                    return ok200thing(caller=self, data=content, raw=True)
+                    return self.payload_response(request, thing, payload, (commit.id, file_name, True), '{}-{}'.format(commit.cid, payload.hash))
                 
                 else: 
-                    # Old behavior
-                    
-                    # GET files for this version, and paste them together (for now)
-                    content  = 'import logger\n'
-                    for file in commit.files.all():
-                        content += file.content
-                    
-                    # Include also app version
-                    content += '\nversion=\'{}\''.format(commit.cid)
+                    # Old behavior (all files pasted together)
+                    payload = get_app_payload(commit)
         
                     logger.info('Sending application code  to TID={}'.format(thing.tid))
-                    return ok200thing(caller=self, data=content, raw=True)
+                    return self.payload_response(request, thing, payload, (commit.id, None, True), '{}-{}'.format(commit.cid, payload.hash))
     
             except Commit.DoesNotExist:
                 return error404thing('No commit found for the specified version')            
@@ -381,6 +512,7 @@ class api_apps_get(ThingAPI):
         token     = request.GET.get('token', None)
         version   = request.GET.get('version', None)
         file_name = request.GET.get('file', None)
+        bundle    = request.GET.get('bundle', None)
 
         # Sanity checks
         if not token:
@@ -407,35 +539,26 @@ class api_apps_get(ThingAPI):
 
         # Get the file for the required version
         try:
-            if file_name:
+            if bundle:
+                # All the files in a single download, with a manifest header
+                payload = get_app_bundle(commit)
+                identity = (commit.id, None, 'bundle')
+            elif file_name:
                 # New Behavior
-                
-                content=''
-                # Get proper file
-                for file in commit.files.all():
-                    if file.name == file_name:
-                        # Load file content
-                        content += file.content
-                
-                        # Include also app version
-                        content += '\nversion=\'{}\''.format(commit.cid)
-    
-                logger.info('Sending file "{}" code  to TID={}'.format(file_name, thing.tid))
-                return HttpResponse(content)
-            
+                payload = get_app_payload(commit, file_name, prologue=False)
+                identity = (commit.id, file_name, False)
             else: 
-                # Old behavior
-                
-                # GET files for this version, and paste them together (for now)
-                content='import logger\n'
-                for file in commit.files.all():
-                    content += file.content
-                
-                # Include also app version
-                content += '\nversion=\'{}\''.format(commit.cid)
-    
+                # Old behavior (all files pasted together)
+                payload = get_app_payload(commit)
+                identity = (commit.id, None, True)
+
+            if bundle:
+                logger.info('Sending application bundle to TID={}'.format(thing.tid))
+            elif file_name:
+                logger.info('Sending file "{}" code  to TID={}'.format(file_name, thing.tid))
+            else:
                 logger.info('Sending application code  to TID={}'.format(thing.tid))
-                return HttpResponse(content)
+            return self.payload_response(request, thing, payload, identity, '{}-{}'.format(commit.cid, payload.hash))
 
         except Commit.DoesNotExist:
             return error404thing('No commit found for the specified version')
@@ -481,29 +604,16 @@ class api_pythings_get(ThingAPI):
         if list:
             
             # Return files for the given version and platform
-            tree='/opt/PythingsOS-dist/PythingsOS/{}/{}'.format(version,platform)
-            files_txt = tree+'/files.txt'
-            logger.info('Opening {}'.format(files_txt))
-            try:
-                with open(files_txt) as f:
-                    content = f.read()
-            except:
-                return error404thing(caller=self, error_msg='Hi, Pythings Cloud here. Could not find platform \''+platform+'\' or version \''+version+'\'.')
-            
-            files_list = {}
-            for line in content.split('\n'):
-                #print ('line', line)
-                try:
-                    _, size, file_name = line.split(':')
-                    files_list[file_name]=size
-                except:
-                    pass
+            tree = dist_index.get_tree(version, platform)
             
             # Naive, simple  check
-            if 'version.py' not in files_list:
+            if not tree or 'version.py' not in tree.manifest:
                 return error404thing(caller=self, error_msg='Hi, Pythings Cloud here. Could not find platform \''+platform+'\' or version \''+version+'\'.')
 
-            return ok200thing(caller=self, data=files_list)
+            etag = self.etag(tree.files_txt.validator)
+            if self.not_modified(request, etag):
+                return notmodified304thing(caller=self, etag=etag)
+            return ok200thing(caller=self, data=tree.manifest, etag=etag)
         
         else:
 
@@ -511,15 +621,34 @@ class api_pythings_get(ThingAPI):
             if not thing.app:
                 return error401thing(caller=self, error_msg='Hi, Pythings Cloud here. This thing is not registered to any App or Account. This should never happen, please report to the support.')
 
-            file_path='/opt/PythingsOS-dist/PythingsOS//{}/{}/{}'.format(version,platform,file_name)            
-            logger.info('Opening {}'.format(file_path))
-            try:
-                with open(file_path) as f:
-                    content = f.read()
-            except:
+            dist_file = dist_index.get_file(version, platform, file_name)
+            if not dist_file:
                 return error404thing(caller=self, error_msg='Hi, Pythings Cloud here. Could not find platform \''+platform+'\' or version \''+version+'\'.')
 
-            return ok200thing(caller=self, data=content, raw=True)
+            logger.info('Sending PythingsOS file "{}" to TID={}'.format(file_name, thing.tid))
+
+            # Plain downloads (not encrypted, compressed or ranged) do not need to go through Python (zero-copy)
+            if not self.payload_encrypter and not self.accepts_deflate(request, thing):
+                try:
+                    byte_range = self.requested_range(request, dist_file.size)
+                except ValueError:
+                    byte_range = True
+                if not byte_range:
+                    etag = self.etag(dist_file.validator)
+                    if self.not_modified(request, etag):
+                        return notmodified304thing(caller=self, etag=etag)
+                    return file200thing(caller=self, file_path=dist_file.path, etag=etag)
+
+            try:
+                payload = dist_file.payload
+            except DistFileChanged:
+                # Changed on disk since indexed: reload the index and use the new file
+                dist_index.load()
+                dist_file = dist_index.get_file(version, platform, file_name)
+                if not dist_file:
+                    return error404thing(caller=self, error_msg='Hi, Pythings Cloud here. Could not find platform \''+platform+'\' or version \''+version+'\'.')
+                payload = dist_file.payload
+            return self.payload_response(request, thing, payload, dist_file.path, dist_file.validator)
 
             
 #=========================
@@ -540,20 +669,13 @@ class api_things_preregister(ThingAPI):
         if not key or not kty or not ken: 
             return error401thing(caller=self, error_msg='Hi, Pythings Cloud here. Error: key/kty/ken are all required.')
         
-        if ken not in ['srsa1']: 
+        # Supported key encryptions: simple RSA, with AES-128 ECB (srsa1) or AES-128 GCM (srsa1-aes128gcm) session cipher
+        if ken not in ['srsa1', 'srsa1-aes128gcm'] or (ken == 'srsa1-aes128gcm' and not aes_gcm_available): 
             return error401thing(caller=self, error_msg='Hi, Pythings Cloud here. Sorry, only srsa encryption is supported.')
         
-        # Un-encrypt the key                
-        with open('../pubkey.key') as f:
-            pubkey = int(f.read())
-
-        with open('../privkey.key') as f:
-            privkey = int(f.read())  
-
-        # Init simple RSA
-        srsa = Srsa(pubkey=pubkey, privkey=privkey)
+        # Un-encrypt the key (simple RSA, with the Cloud key pair)
         try:
-            key = srsa.decrypt_text(key)
+            key = decrypt_preregistration_key(key)
         except Exception as e:
             
             logger.error('Error in decrypting public-key encrypted text: {}'.format(format_exception(e)))         
@@ -564,17 +686,15 @@ class api_things_preregister(ThingAPI):
         numeric = m.group() 
         key = int(numeric)
 
-        # Set payload encrypter (will be used by all the returns)
-        
-        aes128ecb = Aes128ecb(key=key, comp_mode=True)
-        self.payload_encrypter=aes128ecb
-
         # Generate token
         token = str(uuid.uuid4())
 
+        # Set payload encrypter (will be used by all the returns)
+        self.payload_encrypter = get_session_encrypter(token, key, ken)
+
         # Save key in Session
         try:
-            Session.objects.create(token=token,key=key,kty=kty)
+            Session.objects.create(token=token,key=key,kty=kty,ken=ken)
         except Exception as e:
             logger.error(str(e))
             return error500thing(caller=self, error_msg='Hi, Pythings Cloud here. Sorry, something went wrong. Please report this error.')
@@ -751,6 +871,7 @@ class api_things_register(ThingAPI):
         for session in sessions:
             session.active=False
             session.save()
+            invalidate_session_encrypter(session.token)
         
         # Create the toke if not given (after a pre-register)
         if not token:
@@ -848,7 +969,9 @@ class api_things_report(ThingAPI):
                         msg_obj.status='Received'
                         if rep is not None:
                             msg_obj.reply = rep
-                        msg_obj.save()
+                        # Completed, move it to the history
+                        archive_management_messages([msg_obj])
+                        notify_shell(msg_obj)
                         # Increment total messages counter
                         inc_total_messages(user=session.thing.app.user, management=1)
                 else:
@@ -5,16 +5,18 @@ import logging
 # Django imports
 from django.http import HttpResponse
 from django.utils import timezone
+from django.conf import settings
 from django.contrib.auth import authenticate
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
 # Backend imports
 from ..common.utils import format_exception
-from ..common.time import dt_from_str, dt_from_s
+from ..common.time import dt_from_str, dt_from_s, s_from_dt, timezonize
 from ..common.returns import ok200, error400, error401, error404, error500
 from ..common.returns import ok200rest, error400rest, error401rest, error404rest, error500rest
 from .models import ManagementMessage, App, Thing, File, Profile, WorkerMessageHandler
+from .helpers import get_management_messages, get_shell_messages, shell_message_to_dict, notify_shell, ShellListener, touch_user_activity
 
 # Setup logging
 logger = logging.getLogger(__name__)
@@ -203,14 +205,23 @@ class api_msg_management_new(PrivateWebAPI):
     def _post(self, request):
 
         # Obtain values
-        msg = request.data.get('msg', None)
-        tid = request.data.get('tid', None)
+        msg  = request.data.get('msg', None)
+        tid  = request.data.get('tid', None)
+        ttl  = request.data.get('ttl', None)
+        type = request.data.get('type', 'APP')
 
         # Sanity checks
         if not tid:
             return error400rest(caller=self, error_msg='Got empty "tid"')     
         if not msg:
             return error400rest(caller=self, error_msg='Got empty "msg"')
+        if ttl is not None:
+            try:
+                ttl = int(ttl)
+            except (TypeError, ValueError):
+                return error400rest(caller=self, error_msg='Got invalid "ttl" (must be seconds)')
+        if type not in ['APP', 'CMD']:
+            return error400rest(caller=self, error_msg='Got invalid "type" (must be "APP" or "CMD")')
 
         # Load thing for given TID
         try:   
@@ -223,34 +234,74 @@ class api_msg_management_new(PrivateWebAPI):
             return error400rest(caller=self, error_msg='Not existent Thing or no access rights')
             logger.info('SECURITY: Denied access for thing with tid="{}" for user={}"'.format(tid, self.user))
 
-        # Store message
-        management_message = ManagementMessage.objects.create(aid=thing.app.aid, tid=tid, data=msg)
+        # Store message (CMD messages are linked to the Thing and pushed to its remote shell)
+        if type == 'CMD':
+            management_message = ManagementMessage.objects.create(aid=thing.app.aid, tid=tid, data=msg, ttl=ttl, type=type, thing=thing)
+            notify_shell(management_message)
+        else:
+            management_message = ManagementMessage.objects.create(aid=thing.app.aid, tid=tid, data=msg, ttl=ttl)
 
         # Ok, return
         return ok200rest(caller=self, data={'mid': management_message.uuid})
 
 
 class api_msg_management_get(PrivateWebAPI):
-    '''API for getting a specific management message'''
+    '''API for getting a specific management message, or the status of a list of them (optionally
+    waiting, for a short while, until they all got a reply or expired)'''
 
     def _post(self, request):
 
         # Obtain values
-        mid = request.data.get('mid', None)
+        mid  = request.data.get('mid', None)
+        mids = request.data.get('mids', None)
+        wait = request.data.get('wait', None)
 
         # Sanity checks
-        if not mid:
-            return error400rest(caller=self, error_msg='Got empty mid')     
-
-        # Load message for given MID
-        try:   
-            management_message = ManagementMessage.objects.get(uuid=mid)
-        except ManagementMessage.DoesNotExist:
-            return error400rest(caller=self, error_msg='Not existent Message or no access rights')
-                    
-        # TODO: check authorization on the message trought AID -> App -> app.user ?
-        return ok200rest(caller=self, data={'status': management_message.status,
-                                            'reply': management_message.reply})
+        if not mid and not mids:
+            return error400rest(caller=self, error_msg='Got empty mid')
+        if mids is not None:
+            if not isinstance(mids, list):
+                return error400rest(caller=self, error_msg='Got invalid mids (must be a list)')
+            if len(mids) > settings.MANAGEMENT_MESSAGE_MAX_MIDS:
+                return error400rest(caller=self, error_msg='Too many mids (got {}, maximum is {})'.format(len(mids), settings.MANAGEMENT_MESSAGE_MAX_MIDS))
+        if wait is not None:
+            try:
+                wait = float(wait)
+            except (TypeError, ValueError):
+                return error400rest(caller=self, error_msg='Got invalid wait (must be seconds)')
+            wait = min(max(wait, 0), settings.MANAGEMENT_MESSAGE_MAX_WAIT)
+
+        # Load messages for given MIDs with a single query (per queue and history), restricted to the Apps of this
+        # user. If asked to wait, repeat it until all the messages are final (replied or expired) or the timeout expires.
+        mids_to_get = [mid] if mid else mids
+        user_aids = App.objects.filter(user=self.user).values_list('aid', flat=True)
+        wait_until = time.time() + wait if wait else None
+        while True:
+            management_messages = {}
+            for management_message in get_management_messages(uuid__in=mids_to_get, aid__in=user_aids):
+                management_messages[management_message.uuid] = management_message
+            if not wait_until or time.time() >= wait_until:
+                break
+            if len(management_messages) == len(set(mids_to_get)) and all(management_message.status in ['Received', 'Expired'] for management_message in management_messages.values()):
+                break
+            time.sleep(settings.MANAGEMENT_MESSAGE_WAIT_POLL)
+
+        # Single message
+        if mid:
+            if mid not in management_messages:
+                return error400rest(caller=self, error_msg='Not existent Message or no access rights')
+            return ok200rest(caller=self, data={'status': management_messages[mid].status,
+                                                'reply': management_messages[mid].reply})
+
+        # List of messages (not existent or not accessible ones are set to None)
+        data = {}
+        for this_mid in mids:
+            if this_mid in management_messages:
+                data[this_mid] = {'status': management_messages[this_mid].status,
+                                  'reply': management_messages[this_mid].reply}
+            else:
+                data[this_mid] = None
+        return ok200rest(caller=self, data=data)
 
 
 #==============================
@@ -318,3 +369,75 @@ class api_msg_worker_get(PrivateWebAPI):
         
         return ok200rest(caller=self, data=worker_messages)
 
+
+#==============================
+#  Remote shell APIs
+#==============================
+
+class api_shell_history(PrivateWebAPI):
+    '''API for getting the remote shell messages of a Thing incrementally, i.e. only the ones after a given cursor
+    (the timestamp of the last message already loaded) and up to a bounded scrollback. If asked to wait and there
+    is nothing new, it waits (for a short while) for new messages to be pushed, without querying the history again.'''
+
+    def _post(self, request):
+
+        # Obtain values
+        tid     = request.data.get('tid', None)
+        after   = request.data.get('after', None)
+        last    = request.data.get('last', settings.SHELL_SCROLLBACK)
+        pending = request.data.get('pending', [])
+        wait    = request.data.get('wait', 0)
+
+        # Sanity checks
+        if not tid:
+            return error400rest(caller=self, error_msg='Got empty tid')
+        try:
+            after = float(after) if after is not None else None
+            last  = min(int(last), settings.SHELL_SCROLLBACK)
+            wait  = min(max(float(wait), 0), settings.SHELL_LONGPOLL_MAX_WAIT)
+        except (TypeError, ValueError):
+            return error400rest(caller=self, error_msg='Got invalid after, last or wait')
+        if not isinstance(pending, (list, dict)) or len(pending) > settings.SHELL_SCROLLBACK:
+            return error400rest(caller=self, error_msg='Got invalid pending (must be a list, or a map to their status, of at most {} mids)'.format(settings.SHELL_SCROLLBACK))
+
+        # Check thing exists and access rights
+        try:
+            thing = Thing.objects.get(tid=tid, app__user=self.user)
+        except Thing.DoesNotExist:
+            return error400rest(caller=self, error_msg='Not existent Thing or no access rights')
+        user_timezone = timezonize(self.user.profile.timezone)
+
+        touch_user_activity(self.user)
+
+        with ShellListener(thing) as shell_listener:
+
+            # Load new messages, and the current status of the pending ones (i.e. not yet replied) the client already
+            # has. If their status is given, only the ones whose status changed.
+            shell_messages = get_shell_messages(thing, after=after, last=last)
+            cursor = s_from_dt(shell_messages[-1].ts) if shell_messages else after
+            if pending:
+                loaded_mids = set(shell_message.uuid for shell_message in shell_messages)
+                shell_messages += [shell_message for shell_message in get_management_messages(thing=thing, type='CMD', uuid__in=list(pending))
+                                   if shell_message.uuid not in loaded_mids and (not isinstance(pending, dict) or pending[shell_message.uuid] != shell_message.status)]
+            data = []
+            for shell_message in shell_messages:
+                shell_message_dict = shell_message_to_dict(shell_message)
+                shell_message_dict['ts_str'] = str(shell_message.ts.astimezone(user_timezone)).split('.')[0]
+                data.append(shell_message_dict)
+
+            # Nothing new: wait for messages to be pushed, if possible
+            waited = bool(wait and not data and shell_listener.listening)
+            if waited:
+                for shell_message_dict in shell_listener.wait(wait):
+                    if shell_message_dict.get('truncated', False):
+                        management_messages = get_management_messages(thing=thing, uuid=shell_message_dict['mid'])
+                        if not management_messages:
+                            continue
+                        shell_message_dict = shell_message_to_dict(management_messages[0])
+                    shell_message_dict['ts_str'] = str(dt_from_s(shell_message_dict['ts'], tz=user_timezone)).split('.')[0]
+                    data.append(shell_message_dict)
+                    cursor = max(cursor or 0, shell_message_dict['ts'])
+
+        return ok200rest(caller=self, data={'messages': data, 'cursor': cursor, 'waited': waited})
+
+
@@ -1,13 +1,45 @@
 
-from .crypto_engine_aes128ecb import Aes128ecb_engine
+import os
+from base64 import b64encode, b64decode
+from .crypto_engine_aes128ecb import Aes128ecb_ttable_engine
+from .crypto_engine_aes128ecb_native import Aes128ecb_native_engine
+from .crypto_engine_aes128ecb_native import available as native_available
 from .crypto_common import *
 
 # Home-made debugging switch. TODO: use a proper logger.
 debug = False
 
+# AES engine backend: "native" (requires the cryptography package), "python" or "auto" (native if available)
+aes_backend = os.environ.get('PYTHINGS_AES_BACKEND', 'auto')
+
+def get_aes128ecb_engine(key, backend=None):
+    backend = backend or aes_backend
+    if backend == 'native' or (backend == 'auto' and native_available):
+        return Aes128ecb_native_engine(key)
+    elif backend in ['python', 'auto']:
+        return Aes128ecb_ttable_engine(key)
+    else:
+        raise ValueError('Unknown AES backend "{}"'.format(backend))
+
+# Server-side codec helpers
+from_bytes = int.from_bytes
+COMP_SHIFT_1 = 100000000000
+COMP_SHIFT_2 = 100000000000**2
+
+def int_to_bytes_fast(n):
+    return n.to_bytes((n.bit_length() + 7) // 8 or 1, 'big')
+
+def int_to_b64_fast(n):
+    # Same as int_to_b64
+    b64_str = b64encode(int_to_bytes_fast(n)).decode('ascii')
+    if b64_str[-2:] != '==':
+        return b64_str + '&&'
+    else:
+        return b64_str[:-2]
+
 class Aes128ecb():
 
-    def __init__(self, key=None, comp_mode=False):
+    def __init__(self, key=None, comp_mode=False, backend=None):
         if not key:
             # print('AES: Generating new key...')
             key = generate_int_key(128)
@@ -17,135 +49,106 @@ class Aes128ecb():
             # print ('AES: initialized with key', key)
                
         self.key = key
-        self.aes = Aes128ecb_engine(self.key)
+        self.aes = get_aes128ecb_engine(self.key, backend)
         self.comp_mode = comp_mode
         self.chunk_int = 39
         self.chunk_b64 = 22
         self.chunk_txt = 12 if self.comp_mode else 16
         
-    def encrypt_text_stream(self, text):
-        for chunk in split_text(text,self.chunk_txt):
-            if debug: print('AES encrypt: chunk = ', chunk)
-            while len(chunk) < self.chunk_txt:
-                chunk+='&'
-            # Get integer for this chunk starting from 4-bytes sub_chunks for extra-compatibility
-            if self.comp_mode:
-                chunk_as_integer = 0
-                for i, sub_chunk in enumerate(split_text(chunk,4)):
-                    
-                    if debug: print('AES encrypt: sub_ckunk = ', sub_chunk)
- 
-                    sub_chunk_as_bytes = str_to_bytes(sub_chunk)
-                    if debug: print('AES encrypt: sub_chunk_as_bytes = ', sub_chunk_as_bytes)
-    
-                    sub_chunk_as_integer = bytes_to_int(sub_chunk_as_bytes)
-                    if debug: print('AES encrypt: sub_chunk_as_integer = ', sub_chunk_as_integer)
-                    
-                    sub_chunk_as_integer = sub_chunk_as_integer*pow(100000000000,i)
-                    if debug: print('AES encrypt: sub_chunk_as_integer (shifted) = ', sub_chunk_as_integer)
-                    
-                    chunk_as_integer += sub_chunk_as_integer
-                    
+    # The codec below runs on the server only (CPython), hence it does not need the uPy/Py2 compatibility code
+    # of the devices. It produces exactly the same output, in linear time: texts are sliced by index, padded at
+    # once and joined once, and ASCII texts (as the JSON payloads) are encoded to bytes once and sliced as bytes.
+
+    def _encode_blocks(self, text):
+        '''Get the integers (blocks) to be encrypted for a text'''
+        n = self.chunk_txt
+        # Pad the last chunk with "&"s
+        text = text.ljust(-(-len(text)//n)*n, '&')
+        data = text.encode('utf-8')
+        if len(data) != len(text):
+            # Not ASCII, chunks have to be encoded one by one
+            data = None
+        if self.comp_mode:
+            # Get integer for each chunk starting from 4-bytes sub_chunks for extra-compatibility
+            if data is not None:
+                return [from_bytes(data[i:i+4], 'big') + from_bytes(data[i+4:i+8], 'big')*COMP_SHIFT_1 +
+                        from_bytes(data[i+8:i+12], 'big')*COMP_SHIFT_2 for i in range(0, len(data), n)]
             else:
-             
-                chunk_as_bytes = str_to_bytes(chunk)
-                if debug: print('AES encrypt: chunk_as_bytes = ', chunk_as_bytes)
-                
-                chunk_as_integer = bytes_to_int(chunk_as_bytes)
-            
-            if debug: print('AES encrypt: chunk_as_integer = ', chunk_as_integer)
-            chunk_encrypted = self.aes.encrypt(chunk_as_integer)
-            if debug: print('AES encrypt: chunk_encrypted = ', chunk_encrypted)
-            
-            if not self.comp_mode:
-                chunk_encrypted = int_to_b64(chunk_encrypted)
+                return [from_bytes(text[i:i+4].encode('utf-8'), 'big') + from_bytes(text[i+4:i+8].encode('utf-8'), 'big')*COMP_SHIFT_1 +
+                        from_bytes(text[i+8:i+12].encode('utf-8'), 'big')*COMP_SHIFT_2 for i in range(0, len(text), n)]
+        else:
+            if data is not None:
+                return [from_bytes(data[i:i+n], 'big') for i in range(0, len(data), n)]
             else:
-                chunk_encrypted = str(chunk_encrypted)
-                while len(chunk_encrypted) < self.chunk_int:
-                    chunk_encrypted+='&'
-            
-            if debug: print('AES encrypt: chunk_encrypted (padded) = ', chunk_encrypted)
-            yield chunk_encrypted
+                return [from_bytes(text[i:i+n].encode('utf-8'), 'big') for i in range(0, len(text), n)]
+
+    def _format_encrypted_blocks(self, blocks):
+        '''Get the text of the encrypted integers (blocks)'''
+        if self.comp_mode:
+            chunk_int = self.chunk_int
+            return ''.join([str(block).ljust(chunk_int, '&') for block in blocks])
+        else:
+            return ''.join([int_to_b64_fast(block) for block in blocks])
+
+    def encrypt_text_stream(self, text, chunk_blocks=1):
+        # Encrypt chunk_blocks blocks at a time
+        for chunk in split_text(text,self.chunk_txt*chunk_blocks):
+            yield self._format_encrypted_blocks(self.aes.encrypt_blocks(self._encode_blocks(chunk)))
+
+    def encrypted_length(self, text):
+        '''Get the length of the encrypted text without encrypting it, if known in advance. It is in comp_mode,
+        where every chunk is encrypted to exactly chunk_int chars, but not with the base64 encoding.'''
+        if self.comp_mode:
+            return -(-len(text)//self.chunk_txt)*self.chunk_int
+        else:
+            return None
 
     def encrypt_text(self, text):
-        encrypted_text = ''
-        for chunk in self.encrypt_text_stream(text):
-            encrypted_text += chunk
-        return encrypted_text
+        # Encrypt all the blocks in a single engine call
+        return self._format_encrypted_blocks(self.aes.encrypt_blocks(self._encode_blocks(text)))
 
     def encrypt_int(self, integer):
         return self.aes.encrypt(integer)  
 
-    def decrypt_text_stream(self, text):
-        if not self.comp_mode:
-            chunksize = self.chunk_b64
+    def _parse_encrypted_blocks(self, text):
+        '''Get the encrypted integers (blocks) of an encrypted text'''
+        if self.comp_mode:
+            n = self.chunk_int
+            return [int(text[i:i+n].replace('&','')) for i in range(0, len(text), n)]
         else:
-            chunksize = self.chunk_int
-
-        #print('Using chunksize', chunksize)
-        for chunk in split_text(text,chunksize):
-            if debug: print('AES decrypt: chunk = ', chunk)
+            n = self.chunk_b64
+            return [from_bytes(b64decode(chunk.replace('&','') if '&' in chunk else chunk+'=='), 'big')
+                    for chunk in [text[i:i+n] for i in range(0, len(text), n)]]
 
-            if  not self.comp_mode:
-                if '&' in chunk: 
-                    chunk = chunk.replace('&','')
+    def _decode_blocks(self, blocks):
+        '''Get the text of the decrypted integers (blocks)'''
+        parts = []
+        if self.comp_mode:
+            for block in blocks:
+                block_str = str(block).zfill(32)
+                if len(block_str) == 32:
+                    # Three 11-digits sub ints, the first two with a trailing (middle) zero
+                    parts.append(int_to_bytes_fast(int(block_str[22:32])).decode('utf-8'))
+                    parts.append(int_to_bytes_fast(int(block_str[11:21])).decode('utf-8'))
+                    parts.append(int_to_bytes_fast(int(block_str[0:10])).decode('utf-8'))
                 else:
-                    chunk = chunk+'=='
-                chunk_as_int = b64_to_int(chunk)
-            else:
-                chunk = chunk.replace('&','')
-                chunk_as_int = int(chunk)
-            
-            if debug: print('AES decrypt: chunk_as_int = ', chunk_as_int)
-            
-            decrypted_chunk = self.aes.decrypt(chunk_as_int)
-            if debug: print('AES decrypt: decrypted_chunk = ', decrypted_chunk)
-            
-            if self.comp_mode:
-                decrypted_str_chunk = str(decrypted_chunk)
-                while len(decrypted_str_chunk) < 32:
-                    decrypted_str_chunk = '0' + decrypted_str_chunk
-
-                # For each sub int, decryp it:
-                chunk_decrypted = ''
-                for i, sub_chunk in enumerate(split_text(decrypted_str_chunk,11)):
-                    
-                    # Convert to int and remove middle zeroes
-                    if i != 2 :
-                        sub_chunk = sub_chunk[:-1]
-                    sub_chunk = int(sub_chunk)
-                    
-                    sub_chunk_as_bytes = int_to_bytes(sub_chunk)
-                    if debug: print('AES decrypt: sub_chunk_as_bytes', sub_chunk_as_bytes)
-                    
-                    sub_chunk_decrypted = sub_chunk_as_bytes.decode('utf-8').replace('&','')
-                    try: import ustruct # detecs uPy
-                    except: pass
-                    else: sub_chunk_decrypted = ''.join(reversed(sub_chunk_decrypted))
-                    if debug: print('AES decrypt: sub_chunk_decrypted = ', sub_chunk_decrypted)
-                    
-                    chunk_decrypted = sub_chunk_decrypted + chunk_decrypted
-                
-                if debug: print('AES decrypt: chunk_decrypted = ', chunk_decrypted)  
-                yield chunk_decrypted
-                    
-            else:           
-            
-                chunk_as_bytes = int_to_bytes(decrypted_chunk)
-                if debug: print('AES decrypt: chunk_as_bytes = ', chunk_as_bytes)
-                
-                chunk_decrypted = chunk_as_bytes.decode('utf-8').replace('&','')
-                if debug: print('AES decrypt: chunk_decrypted = ', chunk_decrypted) 
-                
-                try: import ustruct # detecs uPy
-                except: yield chunk_decrypted
-                else: yield ''.join(reversed(chunk_decrypted))
+                    sub_chunks = [block_str[i:i+11] for i in range(0, len(block_str), 11)]
+                    for i in reversed(range(len(sub_chunks))):
+                        sub_chunk = sub_chunks[i] if i == 2 else sub_chunks[i][:-1]
+                        parts.append(int_to_bytes_fast(int(sub_chunk)).decode('utf-8'))
+        else:
+            for block in blocks:
+                parts.append(int_to_bytes_fast(block).decode('utf-8'))
+        return ''.join(parts).replace('&','')
+
+    def decrypt_text_stream(self, text):
+        chunksize = self.chunk_int if self.comp_mode else self.chunk_b64
+        for chunk in split_text(text,chunksize):
+            yield self._decode_blocks(self.aes.decrypt_blocks(self._parse_encrypted_blocks(chunk)))
 
     def decrypt_text(self, text):
-        decrypted_text = ''
-        for chunk in self.decrypt_text_stream(text):
-            decrypted_text += chunk
-        return decrypted_text
+        # Decrypt all the blocks in a single engine call
+        return self._decode_blocks(self.aes.decrypt_blocks(self._parse_encrypted_blocks(text)))
 
     def decrypt_int(self, integer):
         return self.aes.decrypt(integer) 
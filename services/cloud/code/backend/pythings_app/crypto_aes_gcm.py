@@ -0,0 +1,45 @@
+
+import os
+from base64 import b64encode, b64decode
+
+# Authenticated AES-128 GCM session cipher, based on the "cryptography" package (OpenSSL)
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.exceptions import InvalidTag
+except ImportError:
+    available = False
+    class InvalidTag(Exception):
+        pass
+else:
+    available = True
+
+# Keys are taken modulo 2^128, as for the AES-128 ECB engines
+MASK128 = (1 << 128) - 1
+
+NONCE_SIZE = 12
+
+
+class Aes128gcm():
+    '''Compact session cipher, with the same text API of Aes128ecb. Every message gets a random nonce and is
+    framed as nonce (12 bytes) + ciphertext (same size as the plaintext) + tag (16 bytes), either as raw bytes
+    (binary-safe, for raw-body requests) or as base64-encoded text (for the "encrypted" field of JSON requests).'''
+
+    def __init__(self, key):
+        self.key = key
+        self.aesgcm = AESGCM((key & MASK128).to_bytes(16, 'big'))
+
+    def encrypt_bytes(self, data):
+        nonce = os.urandom(NONCE_SIZE)
+        return nonce + self.aesgcm.encrypt(nonce, data, None)
+
+    def decrypt_bytes(self, data):
+        # Raises InvalidTag if the message was tampered with, truncated or the key is wrong
+        if len(data) < NONCE_SIZE:
+            raise InvalidTag()
+        return self.aesgcm.decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], None)
+
+    def encrypt_text(self, text):
+        return b64encode(self.encrypt_bytes(text.encode('utf-8'))).decode('ascii')
+
+    def decrypt_text(self, text):
+        return self.decrypt_bytes(b64decode(text)).decode('utf-8')
@@ -17,9 +17,8 @@ def bit_length(n):
     return count
 
 def split_text( text, n ):
-    while text:
-        yield text[:n]
-        text = text[n:]
+    for i in range(0, len(text), n):
+        yield text[i:i+n]
 
 def generate_int_key(size):
     key_str = ''
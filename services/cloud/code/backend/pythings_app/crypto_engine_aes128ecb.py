@@ -152,6 +152,12 @@ class Aes128ecb_engine:
 
         return matrix2text(self.cipher_state)
 
+    def encrypt_blocks(self, blocks):
+        return [self.encrypt(block) for block in blocks]
+
+    def decrypt_blocks(self, blocks):
+        return [self.decrypt(block) for block in blocks]
+
     def __add_round_key(self, s, k):
         for i in range(4):
             for j in range(4):
@@ -231,3 +237,112 @@ class Aes128ecb_engine:
 
 
 
+
+
+#=========================
+#  T-table engine
+#=========================
+
+# Multiplication in GF(2^8), for building the tables
+def gmul(a, b):
+    p = 0
+    while b:
+        if b & 1:
+            p ^= a
+        a = xtime(a)
+        b >>= 1
+    return p
+
+def ror8(word):
+    return ((word >> 8) | (word << 24)) & 0xFFFFFFFF
+
+# Encryption tables (SubBytes + MixColumns on a column, one per byte position)
+Te0 = tuple((gmul(s, 2) << 24) | (s << 16) | (s << 8) | gmul(s, 3) for s in Sbox)
+Te1 = tuple(ror8(word) for word in Te0)
+Te2 = tuple(ror8(word) for word in Te1)
+Te3 = tuple(ror8(word) for word in Te2)
+
+# Decryption tables (InvSubBytes + InvMixColumns on a column, one per byte position)
+Td0 = tuple((gmul(s, 14) << 24) | (gmul(s, 9) << 16) | (gmul(s, 13) << 8) | gmul(s, 11) for s in InvSbox)
+Td1 = tuple(ror8(word) for word in Td0)
+Td2 = tuple(ror8(word) for word in Td1)
+Td3 = tuple(ror8(word) for word in Td2)
+
+
+class Aes128ecb_ttable_engine:
+    '''Drop-in replacement of Aes128ecb_engine (same integer in/out API, same results), working on 32-bit
+    words with precomputed tables instead of byte matrices. Much faster, but not meant for MicroPython.'''
+
+    def __init__(self, master_key):
+        self.change_key(master_key)
+
+    def change_key(self, master_key):
+
+        # Expand the key into 44 words
+        rk = [(master_key >> (96 - 32 * i)) & 0xFFFFFFFF for i in range(4)]
+        for i in range(4, 44):
+            word = rk[i - 1]
+            if i % 4 == 0:
+                word = ((Sbox[(word >> 16) & 0xFF] << 24) | (Sbox[(word >> 8) & 0xFF] << 16) |
+                        (Sbox[word & 0xFF] << 8) | Sbox[word >> 24]) ^ (Rcon[i // 4] << 24)
+            rk.append(rk[i - 4] ^ word)
+        self.round_keys = tuple(rk)
+
+        # Decryption round keys, in reverse order and with InvMixColumns applied (equivalent inverse cipher)
+        drk = list(rk[40:44])
+        for i in range(9, 0, -1):
+            for word in rk[4 * i:4 * (i + 1)]:
+                drk.append(Td0[Sbox[word >> 24]] ^ Td1[Sbox[(word >> 16) & 0xFF]] ^
+                           Td2[Sbox[(word >> 8) & 0xFF]] ^ Td3[Sbox[word & 0xFF]])
+        drk.extend(rk[0:4])
+        self.dec_round_keys = tuple(drk)
+
+    def encrypt(self, plaintext):
+        rk = self.round_keys
+        s0 = ((plaintext >> 96) & 0xFFFFFFFF) ^ rk[0]
+        s1 = ((plaintext >> 64) & 0xFFFFFFFF) ^ rk[1]
+        s2 = ((plaintext >> 32) & 0xFFFFFFFF) ^ rk[2]
+        s3 = (plaintext & 0xFFFFFFFF) ^ rk[3]
+
+        for i in range(4, 40, 4):
+            t0 = Te0[s0 >> 24] ^ Te1[(s1 >> 16) & 0xFF] ^ Te2[(s2 >> 8) & 0xFF] ^ Te3[s3 & 0xFF] ^ rk[i]
+            t1 = Te0[s1 >> 24] ^ Te1[(s2 >> 16) & 0xFF] ^ Te2[(s3 >> 8) & 0xFF] ^ Te3[s0 & 0xFF] ^ rk[i + 1]
+            t2 = Te0[s2 >> 24] ^ Te1[(s3 >> 16) & 0xFF] ^ Te2[(s0 >> 8) & 0xFF] ^ Te3[s1 & 0xFF] ^ rk[i + 2]
+            s3 = Te0[s3 >> 24] ^ Te1[(s0 >> 16) & 0xFF] ^ Te2[(s1 >> 8) & 0xFF] ^ Te3[s2 & 0xFF] ^ rk[i + 3]
+            s0, s1, s2 = t0, t1, t2
+
+        # Last round (no MixColumns)
+        t0 = ((Sbox[s0 >> 24] << 24) | (Sbox[(s1 >> 16) & 0xFF] << 16) | (Sbox[(s2 >> 8) & 0xFF] << 8) | Sbox[s3 & 0xFF]) ^ rk[40]
+        t1 = ((Sbox[s1 >> 24] << 24) | (Sbox[(s2 >> 16) & 0xFF] << 16) | (Sbox[(s3 >> 8) & 0xFF] << 8) | Sbox[s0 & 0xFF]) ^ rk[41]
+        t2 = ((Sbox[s2 >> 24] << 24) | (Sbox[(s3 >> 16) & 0xFF] << 16) | (Sbox[(s0 >> 8) & 0xFF] << 8) | Sbox[s1 & 0xFF]) ^ rk[42]
+        t3 = ((Sbox[s3 >> 24] << 24) | (Sbox[(s0 >> 16) & 0xFF] << 16) | (Sbox[(s1 >> 8) & 0xFF] << 8) | Sbox[s2 & 0xFF]) ^ rk[43]
+        return (t0 << 96) | (t1 << 64) | (t2 << 32) | t3
+
+    def decrypt(self, ciphertext):
+        rk = self.dec_round_keys
+        s0 = ((ciphertext >> 96) & 0xFFFFFFFF) ^ rk[0]
+        s1 = ((ciphertext >> 64) & 0xFFFFFFFF) ^ rk[1]
+        s2 = ((ciphertext >> 32) & 0xFFFFFFFF) ^ rk[2]
+        s3 = (ciphertext & 0xFFFFFFFF) ^ rk[3]
+
+        for i in range(4, 40, 4):
+            t0 = Td0[s0 >> 24] ^ Td1[(s3 >> 16) & 0xFF] ^ Td2[(s2 >> 8) & 0xFF] ^ Td3[s1 & 0xFF] ^ rk[i]
+            t1 = Td0[s1 >> 24] ^ Td1[(s0 >> 16) & 0xFF] ^ Td2[(s3 >> 8) & 0xFF] ^ Td3[s2 & 0xFF] ^ rk[i + 1]
+            t2 = Td0[s2 >> 24] ^ Td1[(s1 >> 16) & 0xFF] ^ Td2[(s0 >> 8) & 0xFF] ^ Td3[s3 & 0xFF] ^ rk[i + 2]
+            s3 = Td0[s3 >> 24] ^ Td1[(s2 >> 16) & 0xFF] ^ Td2[(s1 >> 8) & 0xFF] ^ Td3[s0 & 0xFF] ^ rk[i + 3]
+            s0, s1, s2 = t0, t1, t2
+
+        # Last round (no InvMixColumns)
+        t0 = ((InvSbox[s0 >> 24] << 24) | (InvSbox[(s3 >> 16) & 0xFF] << 16) | (InvSbox[(s2 >> 8) & 0xFF] << 8) | InvSbox[s1 & 0xFF]) ^ rk[40]
+        t1 = ((InvSbox[s1 >> 24] << 24) | (InvSbox[(s0 >> 16) & 0xFF] << 16) | (InvSbox[(s3 >> 8) & 0xFF] << 8) | InvSbox[s2 & 0xFF]) ^ rk[41]
+        t2 = ((InvSbox[s2 >> 24] << 24) | (InvSbox[(s1 >> 16) & 0xFF] << 16) | (InvSbox[(s0 >> 8) & 0xFF] << 8) | InvSbox[s3 & 0xFF]) ^ rk[42]
+        t3 = ((InvSbox[s3 >> 24] << 24) | (InvSbox[(s2 >> 16) & 0xFF] << 16) | (InvSbox[(s1 >> 8) & 0xFF] << 8) | InvSbox[s0 & 0xFF]) ^ rk[43]
+        return (t0 << 96) | (t1 << 64) | (t2 << 32) | t3
+
+    def encrypt_blocks(self, blocks):
+        encrypt = self.encrypt
+        return [encrypt(block) for block in blocks]
+
+    def decrypt_blocks(self, blocks):
+        decrypt = self.decrypt
+        return [decrypt(block) for block in blocks]
@@ -0,0 +1,49 @@
+
+import threading
+
+# Native AES-128 ECB engine, based on the "cryptography" package (OpenSSL)
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    from cryptography.hazmat.backends import default_backend
+except ImportError:
+    available = False
+else:
+    available = True
+
+# Keys and blocks are taken modulo 2^128, as the pure-Python engines implicitly do
+MASK128 = (1 << 128) - 1
+
+
+class Aes128ecb_native_engine:
+    '''Drop-in replacement of Aes128ecb_engine (same integer in/out API, same results) using native AES-ECB'''
+
+    def __init__(self, master_key):
+        self.change_key(master_key)
+
+    def change_key(self, master_key):
+        cipher = Cipher(algorithms.AES((master_key & MASK128).to_bytes(16, 'big')), modes.ECB(), backend=default_backend())
+        # ECB contexts are stateless between blocks, so they can be reused without ever finalizing them
+        self._encryptor = cipher.encryptor()
+        self._decryptor = cipher.decryptor()
+        # Engines can be shared among threads (i.e. cached per session), but contexts cannot be used concurrently
+        self._lock = threading.Lock()
+
+    def encrypt(self, plaintext):
+        with self._lock:
+            return int.from_bytes(self._encryptor.update((plaintext & MASK128).to_bytes(16, 'big')), 'big')
+
+    def decrypt(self, ciphertext):
+        with self._lock:
+            return int.from_bytes(self._decryptor.update((ciphertext & MASK128).to_bytes(16, 'big')), 'big')
+
+    def encrypt_blocks(self, blocks):
+        data = b''.join((block & MASK128).to_bytes(16, 'big') for block in blocks)
+        with self._lock:
+            data = self._encryptor.update(data)
+        return [int.from_bytes(data[i:i+16], 'big') for i in range(0, len(data), 16)]
+
+    def decrypt_blocks(self, blocks):
+        data = b''.join((block & MASK128).to_bytes(16, 'big') for block in blocks)
+        with self._lock:
+            data = self._decryptor.update(data)
+        return [int.from_bytes(data[i:i+16], 'big') for i in range(0, len(data), 16)]
@@ -18,13 +18,75 @@ def pow3(x, y, z):
     return ans
 
 
+# Server-side helpers (built-in pow is fine on the server)
+
+def multinv(modulus, value):
+    '''Multiplicative inverse of value in a given modulus (extended Euclidean algorithm)'''
+    x, lastx = 0, 1
+    a, b = modulus, value
+    while b:
+        a, q, b = b, a // b, a % b
+        x, lastx = lastx - q * x, x
+    result = (1 - lastx * modulus) // value
+    return result + modulus if result < 0 else result
+
+def gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+def recover_primes(pubkey, privkey, pubexp=65537, attempts=100):
+    '''Recover the two primes of the modulus from the private exponent, as e*d-1 is a multiple of the totient.
+    Returns None if not found (it should not happen with a valid key pair).'''
+    k = pubexp * privkey - 1
+    r = k
+    while not r & 1:
+        r >>= 1
+    for g in range(2, 2 + attempts):
+        y = pow(g, r, pubkey)
+        if y == 1 or y == pubkey - 1:
+            continue
+        while True:
+            x = pow(y, 2, pubkey)
+            if x == 1:
+                p = gcd(y - 1, pubkey)
+                return (p, pubkey // p)
+            if x == pubkey - 1:
+                break
+            y = x
+    return None
+
+
 # Main Simple RSA class
 
 class Srsa(object):
     
-    def __init__(self, pubkey, privkey=None):
+    def __init__(self, pubkey, privkey=None, primes=None):
         self.pubkey  = pubkey
         self.privkey = privkey
+        self.primes  = None
+        if primes and privkey:
+            p, q = primes
+            if p * q != pubkey:
+                raise ValueError('The primes do not match the public key')
+            # Precompute the CRT parameters
+            self.primes = (p, q)
+            self.dp = privkey % (p - 1)
+            self.dq = privkey % (q - 1)
+            self.qinv = multinv(p, q)
+
+    def encrypt_int(self, integer):
+        return pow(integer, 65537, self.pubkey)
+
+    def decrypt_int(self, integer):
+        if self.primes:
+            # Chinese Remainder Theorem: two half-size exponentiations
+            p, q = self.primes
+            m1 = pow(integer, self.dp, p)
+            m2 = pow(integer, self.dq, q)
+            return m2 + q * ((m1 - m2) * self.qinv % p)
+        else:
+            return pow(integer, self.privkey, self.pubkey)
 
     def encrypt_text(self, text):
         chunks = []
@@ -37,7 +99,7 @@ class Srsa(object):
             chunk_as_integer = bytes_to_int(chunk_as_bytes)
             if debug: print('RSA encrypt: chunk_as_integer = ',chunk_as_integer)
 
-            chunk_encrypted = pow3(chunk_as_integer, 65537, self.pubkey)
+            chunk_encrypted = self.encrypt_int(chunk_as_integer)
             if debug: print('RSA: encrypted chunk = ', chunk_encrypted)
             
             chunks.append(chunk_encrypted)
@@ -45,12 +107,12 @@ class Srsa(object):
         return chunks
 
     def decrypt_text(self, chunks):
-        message=''
+        message = []
         for chunk in chunks:
             
             if debug: print('RSA decrypt: decrypting chunk = ', chunk)
             
-            chunk_decrypted = pow3(chunk, self.privkey, self.pubkey)
+            chunk_decrypted = self.decrypt_int(chunk)
             if debug: print ('RSA decrypt: chunk as integer = ',chunk_decrypted)
             
             chunk_as_bytes = int_to_bytes(chunk_decrypted)
@@ -59,7 +121,6 @@ class Srsa(object):
             chunk_as_string = chunk_as_bytes.decode('utf-8')
             if debug: print('RSA decrypt: decrypted chunk = ', chunk_as_string)
             
-            message += chunk_as_string
+            message.append(chunk_as_string)
             
-        return message
-
+        return ''.join(message)
@@ -0,0 +1,163 @@
+import os
+import time
+import threading
+import logging
+
+# Django imports
+from django.conf import settings
+
+# Backend imports
+from .payloads import Payload, dist_payloads_cache
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+#=========================
+#  Dist files
+#=========================
+
+def dist_file_validator(stat):
+    '''Get a validator for a PythingsOS dist file, from its inode, modification time and size'''
+    return '{:x}-{:x}-{:x}'.format(stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class DistFileChanged(Exception):
+    '''Raised when a dist file changed on disk since it was indexed'''
+    pass
+
+
+class DistFile(object):
+    '''A PythingsOS dist file. Its content is read (and cached as payload) on first access, and not memory-mapped as dist
+    files can be rewritten in place, which would make a mapping change under the cached payload or even crash (SIGBUS).'''
+
+    def __init__(self, path, stat):
+        self.path = path
+        self.size = stat.st_size
+        self.validator = dist_file_validator(stat)
+
+    def read(self):
+        '''Read the content of the file, checking that it is still the indexed one'''
+        with open(self.path, 'rb') as f:
+            if dist_file_validator(os.fstat(f.fileno())) != self.validator:
+                raise DistFileChanged('Dist file "{}" changed since indexed'.format(self.path))
+            data = f.read()
+        if len(data) != self.size:
+            raise DistFileChanged('Dist file "{}" changed while read'.format(self.path))
+        return data
+
+    @property
+    def payload(self):
+        return dist_payloads_cache.get_or_set((self.path, self.validator),
+                                              lambda: Payload(self.read().decode('utf-8')),
+                                              sizeof=lambda payload: payload.cache_size)
+
+
+class DistTree(object):
+    '''The PythingsOS dist files for a given version and platform'''
+
+    def __init__(self, path):
+        self.path = path
+        files_txt = os.path.join(path, 'files.txt')
+        self.files_txt = DistFile(files_txt, os.stat(files_txt))
+
+        # Parse the manifest (files.txt) and index the files in it
+        self.manifest = {}
+        self.files = {}
+        with open(files_txt) as f:
+            content = f.read()
+        for line in content.split('\n'):
+            try:
+                _, size, file_name = line.split(':')
+            except ValueError:
+                continue
+            self.manifest[file_name] = size
+            try:
+                self.files[file_name] = DistFile(os.path.join(path, file_name), os.stat(os.path.join(path, file_name)))
+            except OSError:
+                logger.warning('Dist file "{}" listed in "{}" not found'.format(file_name, files_txt))
+
+
+#=========================
+#  Dist index
+#=========================
+
+class DistIndex(object):
+    '''In-process index of the PythingsOS dist trees, by version and platform. Lookups do not touch the disk: the index
+    is loaded at startup, and a background thread checks for changes (of the directories and of the files) every
+    DIST_INDEX_CHECK_INTERVAL seconds, so that requests never pay for it.'''
+
+    def __init__(self, root):
+        self.root = root
+        self.trees = None
+        self.signature = None
+        self._lock = threading.Lock()
+        self._watcher_pid = None
+
+    def _signature(self):
+        '''Get the signature of the dist trees, as the modification times of their directories and the validators
+        of all their files, so that files replaced or rewritten in place are detected as well'''
+        signature = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            signature.append((dirpath, os.stat(dirpath).st_mtime_ns))
+            for filename in sorted(filenames):
+                try:
+                    signature.append((os.path.join(dirpath, filename), dist_file_validator(os.stat(os.path.join(dirpath, filename)))))
+                except OSError:
+                    pass
+        return signature
+
+    def load(self):
+        '''(Re)load the index, if the dist trees have changed. Requests still using the old trees are not affected.'''
+        with self._lock:
+            signature = self._signature()
+            if signature == self.signature:
+                return
+            trees = {}
+            for version in (os.listdir(self.root) if os.path.isdir(self.root) else []):
+                if not os.path.isdir(os.path.join(self.root, version)):
+                    continue
+                for platform in os.listdir(os.path.join(self.root, version)):
+                    path = os.path.join(self.root, version, platform)
+                    if os.path.isfile(os.path.join(path, 'files.txt')):
+                        try:
+                            trees[(version, platform)] = DistTree(path)
+                        except Exception as e:
+                            logger.error('Cannot load dist tree "{}": {}'.format(path, e))
+            self.trees = trees
+            self.signature = signature
+            logger.info('Loaded PythingsOS dist index with {} trees'.format(len(trees)))
+
+    def _watch(self):
+        while True:
+            time.sleep(settings.DIST_INDEX_CHECK_INTERVAL)
+            try:
+                self.load()
+            except Exception as e:
+                logger.error('Cannot reload the PythingsOS dist index: {}'.format(e))
+
+    def watch(self):
+        '''Start checking for changes in the background, once per process (threads do not survive the uWSGI fork)'''
+        if self._watcher_pid != os.getpid():
+            with self._lock:
+                if self._watcher_pid != os.getpid():
+                    threading.Thread(target=self._watch, name='DistIndexWatcher', daemon=True).start()
+                    self._watcher_pid = os.getpid()
+
+    def get_tree(self, version, platform):
+        '''Get the dist tree for a given version and platform, or None if not found'''
+        if self.trees is None:
+            self.load()
+        self.watch()
+        return self.trees.get((version, platform), None)
+
+    def get_file(self, version, platform, file_name):
+        '''Get a dist file for a given version and platform, or None if not found'''
+        tree = self.get_tree(version, platform)
+        if not tree:
+            return None
+        return tree.files.get(file_name, None)
+
+
+dist_index = DistIndex(settings.PYTHINGSOS_DIST_ROOT)
@@ -1,10 +1,29 @@
+import os
+import math
 import calendar
 import time
 import uuid
+import json
+import select
+import hashlib
 import logging
+import threading
+from datetime import timedelta
+
+# Django imports
+from django.conf import settings as django_settings
+from django.db import transaction, connection
+from django.db.models import Q
+from django.utils import timezone
 
 # Backend imports
-from .models import App, Settings, Pool, File, MessageCounter, WorkerMessage, ManagementMessage, Commit, Thing, Profile
+from ..common.time import s_from_dt, dt_from_s
+from ..common.cache import LRUCache
+from .payloads import prerender_app_payloads
+from .crypto_aes import Aes128ecb
+from .crypto_aes_gcm import Aes128gcm
+from .crypto_rsa import Srsa, recover_primes
+from .models import App, Settings, Pool, File, MessageCounter, WorkerMessage, ManagementMessage, ManagementMessageHistory, Commit, Thing, Profile, Session, Rollout
 
 # Setup logging
 logger = logging.getLogger(__name__)
@@ -149,6 +168,9 @@ def create_app(name,user,aid=None, management_interval='60', worker_interval='30
     commit.files.add(file2)
     commit.valid=True
     commit.save()
+
+    # Pre-render the payloads for the Things
+    prerender_app_payloads(commit)
     
     return app
 
@@ -212,6 +234,366 @@ def inc_total_messages(user, worker=0, management=0):
     message_counter.save()
 
 
+#=========================
+#  Management messages
+#=========================
+
+MANAGEMENT_MESSAGE_FIELDS = ['aid', 'tid', 'ts', 'uuid', 'status', 'type', 'thing_id', 'data', 'reply', 'ttl', 'expires']
+
+
+def get_management_messages(last=None, **kwargs):
+    '''Get the management messages matching the given filters, from both the live queue and the history, sorted
+    by timestamp. If "last" is set, only the last (most recent) ones are loaded and returned.'''
+    querysets = [ManagementMessage.objects.filter(**kwargs), ManagementMessageHistory.objects.filter(**kwargs)]
+    if last is not None:
+        querysets = [queryset.order_by('-ts')[0:last] for queryset in querysets]
+    management_messages = list(querysets[0]) + list(querysets[1])
+    management_messages.sort(key=lambda management_message: management_message.ts)
+    if last is not None:
+        management_messages = management_messages[-last:] if last else []
+    return management_messages
+
+
+def archive_management_messages(management_messages):
+    '''Move the given (completed) management messages from the live queue to the history'''
+    management_messages = list(management_messages)
+    if not management_messages:
+        return 0
+    with transaction.atomic():
+        ManagementMessageHistory.objects.bulk_create([ManagementMessageHistory(**{field: getattr(management_message, field) for field in MANAGEMENT_MESSAGE_FIELDS})
+                                                      for management_message in management_messages])
+        ManagementMessage.objects.filter(id__in=[management_message.id for management_message in management_messages]).delete()
+    return len(management_messages)
+
+
+def expire_management_messages(batch_size=1000):
+    '''Expire the not yet replied management messages whose TTL is over, and move them together with the
+    received ones (i.e. left over in the live queue) to the history. Returns the number of expired messages.'''
+    now = timezone.now()
+    expired_filter = Q(expires__lte=now) | Q(ttl__isnull=True, ts__lte=now-timedelta(seconds=django_settings.MANAGEMENT_MESSAGE_DEFAULT_TTL))
+    total_expired = ManagementMessage.objects.filter(expired_filter, status__in=['Queued','Delivered']).update(status='Expired')
+    while True:
+        management_messages = ManagementMessage.objects.filter(status__in=['Received','Expired'])[0:batch_size]
+        if not archive_management_messages(management_messages):
+            break
+    if total_expired:
+        logger.info('Expired {} management messages'.format(total_expired))
+    return total_expired
+
+
+def purge_management_messages_history(batch_size=1000):
+    '''Delete the management messages archived in the history for longer than the retention.
+    Returns the number of deleted messages.'''
+    archived_before = timezone.now() - timedelta(seconds=django_settings.MANAGEMENT_MESSAGE_HISTORY_RETENTION)
+    total_purged = 0
+    while True:
+        ids = list(ManagementMessageHistory.objects.filter(archived__lt=archived_before).values_list('id', flat=True)[0:batch_size])
+        if not ids:
+            break
+        total_purged += ManagementMessageHistory.objects.filter(id__in=ids).delete()[0]
+    if total_purged:
+        logger.info('Purged {} management messages from the history'.format(total_purged))
+    return total_purged
+
+
+#=========================
+#  Adaptive polling
+#=========================
+
+# Last activity as seen by the poll hints, by ('thing', tid) for the management messages history and by ('user', id) for
+# the dashboard, so that it is read from the database only once in a while (the hints may lag by up to the TTL)
+poll_activity_cache = LRUCache(max_items=django_settings.POLL_ACTIVITY_CACHE_SIZE, ttl=django_settings.POLL_ACTIVITY_CACHE_TTL)
+
+def touch_user_activity(user):
+    '''Mark the user as active on the dashboard (at most once a minute, to spare writes)'''
+    now = timezone.now()
+    last_activity_dt = poll_activity_cache.get(('user', user.id))
+    if last_activity_dt is not None and last_activity_dt >= now-timedelta(seconds=60):
+        return
+    poll_activity_cache.set(('user', user.id), now)
+    Profile.objects.filter(Q(last_activity__isnull=True) | Q(last_activity__lt=now-timedelta(seconds=60)), user=user).update(last_activity=now)
+
+
+def get_next_poll_s(thing, settings, pending=False):
+    '''Compute the hint for the next management poll of a Thing (in seconds): as fast as allowed if there is work
+    pending, if the Thing had recent management messages or if its user is active on the dashboard, otherwise
+    exponentially backed off with the idle time and the server load. Bounded by the (pool) settings min and max.'''
+    try:
+        interval = int(settings.management_interval)
+    except (TypeError, ValueError):
+        return None
+    min_s = settings.management_interval_min or interval
+    max_s = max(settings.management_interval_max or interval, min_s)
+    if pending:
+        # The Thing is getting a management message right now: that is activity too
+        poll_activity_cache.set(('thing', thing.tid), timezone.now())
+        return min_s
+    if min_s == max_s:
+        return min_s
+
+    # Last activity, either of the management queue or of the user on the dashboard. The live queue is always checked,
+    # so that new messages (queued by any process) are seen right away.
+    last_activity_dts = [ManagementMessage.objects.filter(tid=thing.tid).order_by('-ts').values_list('ts', flat=True).first(),
+                         poll_activity_cache.get_or_set(('thing', thing.tid), lambda: ManagementMessageHistory.objects.filter(tid=thing.tid).order_by('-ts').values_list('ts', flat=True).first()),
+                         poll_activity_cache.get_or_set(('user', thing.app.user_id), lambda: Profile.objects.filter(user_id=thing.app.user_id).values_list('last_activity', flat=True).first())]
+    last_activity_dts = [last_activity_dt for last_activity_dt in last_activity_dts if last_activity_dt is not None]
+    idle_s = (timezone.now() - max(last_activity_dts)).total_seconds() if last_activity_dts else None
+    if idle_s is not None and idle_s < django_settings.MANAGEMENT_POLL_ACTIVE_WINDOW:
+        return min_s
+
+    # Idle: double the interval for each (doubling) active window of idle time
+    if idle_s is None:
+        next_poll_s = max_s
+    else:
+        next_poll_s = interval * 2**int(math.log(idle_s/django_settings.MANAGEMENT_POLL_ACTIVE_WINDOW, 2))
+
+    # Back off further if the server is loaded
+    try:
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        load = 0
+    if load > 1:
+        next_poll_s = next_poll_s * load
+
+    return int(min(max(next_poll_s, min_s), max_s))
+
+
+#=========================
+#  Remote shell
+#=========================
+
+def get_shell_messages(thing, after=None, last=None):
+    '''Get the remote shell (CMD) messages of a Thing, only the ones after the "after" cursor
+    (epoch seconds) if set, and only the last "last" ones if set.'''
+    if after is not None:
+        return get_management_messages(last=last, thing=thing, type='CMD', ts__gt=dt_from_s(after))
+    else:
+        return get_management_messages(last=last, thing=thing, type='CMD')
+
+
+def shell_message_to_dict(management_message):
+    return {'mid': management_message.uuid,
+            'ts': s_from_dt(management_message.ts),
+            'status': management_message.status,
+            'data': management_message.data,
+            'reply': management_message.reply}
+
+
+def shell_channel(thing_id):
+    '''Name of the notification channel for the remote shell of a Thing (given its internal id)'''
+    return 'shell_{}'.format(int(thing_id))
+
+
+def notify_shell(management_message):
+    '''Push a CMD management message (new, delivered or replied) to the listeners of the remote shell of its Thing.
+    Relies on Postgres NOTIFY, so that the listeners do not have to query the database for the shell history.'''
+    if management_message.type != 'CMD' or not management_message.thing_id or connection.vendor != 'postgresql':
+        return
+    payload = json.dumps(shell_message_to_dict(management_message))
+
+    # Postgres payloads are limited to 8000 bytes, in case just send the mid (listeners will load the message)
+    if len(payload.encode('utf-8')) > 7900:
+        payload = json.dumps({'mid': management_message.uuid, 'truncated': True})
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)', [shell_channel(management_message.thing_id), payload])
+
+
+# Threads (per process) allowed to wait for remote shell messages at once, so that the others keep serving requests
+_shell_waiters = threading.BoundedSemaphore(django_settings.SHELL_LONGPOLL_MAX_WAITERS)
+
+class ShellListener(object):
+    '''Listener for the remote shell messages of a Thing, as notified by notify_shell(), on the database connection
+    of the request (Postgres LISTEN). To be entered before loading the shell messages, so that none gets lost in
+    between. It does not listen (and "listening" is False) if not on Postgres, within a transaction, or if there
+    are already SHELL_LONGPOLL_MAX_WAITERS threads of this process waiting.'''
+
+    def __init__(self, thing):
+        self.channel = shell_channel(thing.id)
+        self.listening = False
+
+    def __enter__(self):
+        if connection.vendor == 'postgresql' and not connection.in_atomic_block and _shell_waiters.acquire(blocking=False):
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('LISTEN {}'.format(self.channel))
+            except Exception:
+                _shell_waiters.release()
+                raise
+            self.listening = True
+        return self
+
+    def wait(self, timeout):
+        '''Wait for messages to be notified, for at most "timeout" seconds. Returns the notified messages (as dicts).'''
+        notified = []
+        if not self.listening:
+            return notified
+        pg_connection = connection.connection
+        wait_until = time.time() + timeout
+        while True:
+            pg_connection.poll()
+            while pg_connection.notifies:
+                notified.append(json.loads(pg_connection.notifies.pop(0).payload))
+            remaining = wait_until - time.time()
+            if notified or remaining <= 0:
+                return notified
+            select.select([pg_connection], [], [], remaining)
+
+    def __exit__(self, *args):
+        if self.listening:
+            self.listening = False
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('UNLISTEN {}'.format(self.channel))
+                del connection.connection.notifies[:]
+            finally:
+                _shell_waiters.release()
+
+
 def get_timezone_from_request(request):
     return request.user.profile.timezone
 
+
+#=========================
+#  App versions rollouts
+#=========================
+
+def start_rollout(pool, from_version, to_version):
+    '''Start a staged rollout of a new App version on a pool, superseding any rollout in progress. Development
+    pools and small pools do not need it, and just switch all their Things to the new version at once.'''
+    Rollout.objects.filter(pool=pool, status__in=['Running', 'Paused']).update(status='Superseded', updated=timezone.now())
+    if not from_version or from_version == to_version or pool.development:
+        return None
+    if Thing.objects.filter(pool=pool, use_custom_settings=False).count() < django_settings.ROLLOUT_MIN_THINGS:
+        return None
+    logger.info('Starting rollout of App version "{}" on pool "{}"'.format(to_version, pool.name))
+    return Rollout.objects.create(pool=pool, from_version=from_version, to_version=to_version,
+                                  percentage=django_settings.ROLLOUT_INITIAL_PERCENTAGE)
+
+
+def get_rollout(pool):
+    '''Get the rollout in progress (running or paused) on a pool, if any'''
+    return Rollout.objects.filter(pool=pool, status__in=['Running', 'Paused']).order_by('-started').first()
+
+
+def get_rollout_app_version(thing, app_version, running_version=None):
+    '''Get the App version a Thing should run, given the one set in its pool settings and the rollout in progress.
+    Things are exposed to the new version in a stable order (by a hash of their TID), and never rolled back.'''
+    if thing.use_custom_settings:
+        return app_version
+    rollout = get_rollout(thing.pool)
+    if not rollout or rollout.to_version != app_version or running_version == app_version:
+        return app_version
+    bucket = int(hashlib.md5('{}:{}'.format(rollout.id, thing.tid).encode('utf-8')).hexdigest(), 16) % 10000 / 100.0
+    if bucket < rollout.percentage:
+        return rollout.to_version
+    else:
+        return rollout.from_version
+
+
+def get_rollout_error_rates(rollout):
+    '''Get the worker error rates (as per the last worker status) of the active Things of a rollout,
+    for the old and the new version, as (rate, sample size) tuples.'''
+    error_rates = []
+    for version in [rollout.from_version, rollout.to_version]:
+        sessions = Session.objects.filter(pool=rollout.pool, active=True, app_version=version)
+        total = sessions.count()
+        errors = sessions.filter(last_worker_status__istartswith='KO').count()
+        error_rates.append((errors/float(total) if total else 0.0, total))
+    return error_rates
+
+
+def advance_rollouts():
+    '''Advance the running rollouts: grow the percentage of Things exposed to the new version, within the global
+    downloads budget (shared among the running rollouts), or pause them if the error rate of the new version rises.'''
+    now = timezone.now()
+    rollouts = list(Rollout.objects.filter(status='Running').select_related('pool', 'pool__settings'))
+    if not rollouts:
+        return 0
+    downloads_budget = django_settings.ROLLOUT_MAX_DOWNLOADS_PER_S / float(len(rollouts))
+    advanced = 0
+    for rollout in rollouts:
+        if (now - rollout.updated).total_seconds() < django_settings.ROLLOUT_STEP_INTERVAL:
+            continue
+
+        # Pause if the new version performs worse than the old one
+        (old_rate, _), (new_rate, new_total) = get_rollout_error_rates(rollout)
+        if new_total >= django_settings.ROLLOUT_MIN_SAMPLE and new_rate > old_rate + django_settings.ROLLOUT_MAX_ERROR_RATE_INCREASE:
+            logger.warning('Pausing rollout of App version "{}" on pool "{}": error rate {:.2f} (was {:.2f})'.format(rollout.to_version, rollout.pool.name, new_rate, old_rate))
+            rollout.status = 'Paused'
+            rollout.updated = now
+            rollout.save()
+            continue
+
+        # The Things newly exposed get the new version at their next management poll, and then download all its files
+        things = Thing.objects.filter(pool=rollout.pool, use_custom_settings=False).count()
+        commit = Commit.objects.filter(app=rollout.pool.app, cid=rollout.to_version).first()
+        files = max(commit.files.count() if commit else 1, 1)
+        try:
+            management_interval = int(rollout.pool.settings.management_interval)
+        except (TypeError, ValueError):
+            management_interval = 60
+        budget_percentage = downloads_budget * management_interval / files / max(things, 1) * 100
+        rollout.percentage = min(100.0, rollout.percentage + min(django_settings.ROLLOUT_STEP_PERCENTAGE, budget_percentage))
+        if rollout.percentage >= 100:
+            rollout.status = 'Completed'
+        rollout.updated = now
+        rollout.save()
+        advanced += 1
+    return advanced
+
+
+#=========================
+#  Sessions encryption
+#=========================
+
+# Payload encrypters (AES engines with their expanded keys) by session token, so that they are not re-created on every request
+session_encrypters_cache = LRUCache(max_items=django_settings.SESSION_ENCRYPTERS_CACHE_SIZE)
+
+def get_session_encrypter(token, key, ken=None):
+    '''Get the payload encrypter for a session, reusing the one of its previous requests if any. The session cipher
+    is AES-128 GCM for the sessions preregistered with the "srsa1-aes128gcm" key encryption, AES-128 ECB otherwise.'''
+    key = int(key)
+    encrypter_class = Aes128gcm if ken == 'srsa1-aes128gcm' else Aes128ecb
+    encrypter = session_encrypters_cache.get(token)
+    if encrypter is None or encrypter.key != key or not isinstance(encrypter, encrypter_class):
+        if encrypter_class is Aes128gcm:
+            encrypter = Aes128gcm(key=key)
+        else:
+            encrypter = Aes128ecb(key=key, comp_mode=True)
+        session_encrypters_cache.set(token, encrypter)
+    return encrypter
+
+
+def invalidate_session_encrypter(token):
+    '''Forget the payload encrypter for a session (i.e. when the session is deactivated)'''
+    session_encrypters_cache.delete(token)
+
+
+#=========================
+#  Preregistration keys
+#=========================
+
+_srsa = None
+_srsa_lock = threading.Lock()
+
+def get_srsa():
+    '''Get the simple RSA decrypter with the Cloud key pair, loading the keys only once (per process)'''
+    global _srsa
+    if _srsa is None:
+        with _srsa_lock:
+            if _srsa is None:
+                with open(django_settings.RSA_PUBKEY_FILE) as f:
+                    pubkey = int(f.read())
+                with open(django_settings.RSA_PRIVKEY_FILE) as f:
+                    privkey = int(f.read())
+                # The primes are not stored with the keys, but they can be recovered to decrypt using the CRT
+                primes = recover_primes(pubkey, privkey)
+                if not primes:
+                    logger.warning('Cannot recover the primes of the Cloud RSA key pair, not using the CRT')
+                _srsa = Srsa(pubkey=pubkey, privkey=privkey, primes=primes)
+    return _srsa
+
+
+def decrypt_preregistration_key(key):
+    '''Decrypt a (simple RSA encrypted) preregistration key'''
+    return get_srsa().decrypt_text(key)
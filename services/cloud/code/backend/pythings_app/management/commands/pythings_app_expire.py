@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ...helpers import expire_management_messages, purge_management_messages_history
+
+class Command(BaseCommand):
+
+    help = 'Expire management messages whose TTL is over, move completed ones to the history and purge the old history'
+
+    def handle(self, *args, **kwargs):
+
+        total_expired = expire_management_messages()
+        print('Expired {} management messages.'.format(total_expired))
+        total_purged = purge_management_messages_history()
+        print('Purged {} management messages from the history.'.format(total_purged))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from ...helpers import advance_rollouts
+
+class Command(BaseCommand):
+
+    help = 'Advance the staged rollouts of new App versions, or pause them if the error rate rises'
+
+    def handle(self, *args, **kwargs):
+
+        total_advanced = advance_rollouts()
+        print('Advanced {} rollouts.'.format(total_advanced))
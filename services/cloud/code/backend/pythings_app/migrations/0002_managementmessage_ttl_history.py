@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-19 09:12
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pythings_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ManagementMessageHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('aid', models.CharField(max_length=36, verbose_name='App ID')),
+                ('tid', models.CharField(max_length=36, verbose_name='Thing ID')),
+                ('ts', models.DateTimeField(blank=True, default=django.utils.timezone.now, verbose_name='Message timestamp')),
+                ('uuid', models.CharField(max_length=36, verbose_name='Message uuid')),
+                ('status', models.CharField(default='Queued', max_length=36, verbose_name='Message status')),
+                ('type', models.CharField(default='APP', max_length=36, verbose_name='Message status')),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True)),
+                ('reply', django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True)),
+                ('ttl', models.IntegerField(blank=True, null=True, verbose_name='Message TTL (s)')),
+                ('expires', models.DateTimeField(blank=True, null=True, verbose_name='Message expiration timestamp')),
+                ('archived', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Archived timestamp')),
+                ('thing', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='pythings_app.Thing')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='managementmessage',
+            name='ttl',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Message TTL (s)'),
+        ),
+        migrations.AddField(
+            model_name='managementmessage',
+            name='expires',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Message expiration timestamp'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='managementmessagehistory',
+            unique_together=set([('tid', 'uuid')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='managementmessage',
+            index_together=set([('tid', 'status', 'ts')]),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-19 10:03
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pythings_app', '0002_managementmessage_ttl_history'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='managementmessage',
+            index_together=set([('tid', 'status', 'ts'), ('thing', 'type', 'ts')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='managementmessagehistory',
+            index_together=set([('thing', 'type', 'ts')]),
+        ),
+    ]
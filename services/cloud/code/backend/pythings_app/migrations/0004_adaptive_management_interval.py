@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-19 10:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pythings_app', '0003_managementmessage_shell_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='settings',
+            name='management_interval_min',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Management interval lower bound (adaptive)'),
+        ),
+        migrations.AddField(
+            model_name='settings',
+            name='management_interval_max',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Management interval upper bound (adaptive)'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='last_activity',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last dashboard activity'),
+        ),
+    ]
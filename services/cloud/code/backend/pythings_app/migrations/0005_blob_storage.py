@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-19 11:30
+from __future__ import unicode_literals
+
+import hashlib
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def files_content_to_blobs(apps, schema_editor):
+    File = apps.get_model('pythings_app', 'File')
+    Blob = apps.get_model('pythings_app', 'Blob')
+    for file in File.objects.all().iterator():
+        content_bytes = file.content.encode('utf-8')
+        file.blob, _ = Blob.objects.get_or_create(hash=hashlib.sha256(content_bytes).hexdigest(),
+                                                  defaults={'content': file.content, 'size': len(content_bytes)})
+        file.save(update_fields=['blob'])
+
+
+def blobs_to_files_content(apps, schema_editor):
+    File = apps.get_model('pythings_app', 'File')
+    for file in File.objects.select_related('blob').all().iterator():
+        file.content = file.blob.content if file.blob else ''
+        file.save(update_fields=['content'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pythings_app', '0004_adaptive_management_interval'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('hash', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='SHA-256 hash')),
+                ('content', models.TextField(default='', verbose_name='Contents')),
+                ('size', models.IntegerField(default=0, verbose_name='Size (bytes)')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='blob',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='pythings_app.Blob'),
+        ),
+        migrations.RunPython(files_content_to_blobs, blobs_to_files_content),
+        migrations.RemoveField(
+            model_name='file',
+            name='content',
+        ),
+    ]
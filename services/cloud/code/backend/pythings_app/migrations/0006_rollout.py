@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-19 12:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pythings_app', '0005_blob_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rollout',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_version', models.CharField(max_length=36, verbose_name='From App version')),
+                ('to_version', models.CharField(max_length=36, verbose_name='To App version')),
+                ('started', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Rollout start timestamp')),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Rollout last update timestamp')),
+                ('percentage', models.FloatField(default=0, verbose_name='Percentage of Things exposed to the new version')),
+                ('status', models.CharField(default='Running', max_length=36, verbose_name='Rollout status')),
+                ('pool', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='pythings_app.Pool')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='rollout',
+            index_together=set([('pool', 'status')]),
+        ),
+    ]
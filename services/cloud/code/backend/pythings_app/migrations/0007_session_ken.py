@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-19 15:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pythings_app', '0006_rollout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='session',
+            name='ken',
+            field=models.CharField(blank=True, max_length=36, null=True, verbose_name='Key encryption'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-19 17:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pythings_app', '0007_session_ken'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='managementmessagehistory',
+            name='archived',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Archived timestamp'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-19 17:25
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pythings_app', '0008_managementmessagehistory_archived_index'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='managementmessagehistory',
+            index_together=set([('thing', 'type', 'ts'), ('tid', 'ts')]),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-19 17:01
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pythings_app', '0009_managementmessagehistory_tid_ts_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commit',
+            name='bundle',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='pythings_app.Blob'),
+        ),
+    ]
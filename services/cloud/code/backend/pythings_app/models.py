@@ -1,13 +1,16 @@
 import uuid
 import time
+import hashlib
 import json
 import logging
+from datetime import timedelta
 
 # Django imports
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.contrib.postgres.fields import JSONField
+from django.conf import settings as django_settings
 
 # Setup logging
 logger = logging.getLogger(__name__) 
@@ -35,17 +38,64 @@ class App(models.Model):
 
 
 #=========================
-#  File, Commit, Branch
+#  Blob, File, Commit
 #=========================
 
+class Blob(models.Model):
+    '''Content-addressed storage for the File contents, keyed by their SHA-256 hash. Identical contents
+    (across files, commits and apps) are stored only once.'''
+
+    hash    = models.CharField('SHA-256 hash', max_length=64, primary_key=True)
+    content = models.TextField('Contents', default='')
+    size    = models.IntegerField('Size (bytes)', default=0)
+
+    @classmethod
+    def store(cls, content):
+        '''Get the Blob for the given content, creating it if not already stored'''
+        content_bytes = content.encode('utf-8')
+        blob, _ = cls.objects.get_or_create(hash=hashlib.sha256(content_bytes).hexdigest(),
+                                            defaults={'content': content, 'size': len(content_bytes)})
+        return blob
+
+    def __str__(self):
+        return str('Blob "{}" of {} bytes'.format(self.hash, self.size))
+
+
 class File(models.Model):
 
     name      = models.CharField('File name', max_length=36, blank=False, null=False)
     path      = models.CharField('File path', max_length=256, default='/')
-    content   = models.TextField('File contents', default='')
+    blob      = models.ForeignKey(Blob, related_name='+', null=True, on_delete=models.PROTECT)
     app       = models.ForeignKey(App, related_name='+')
     ts        = models.DateTimeField('Creation timestamp', default=timezone.now)
     committed  = models.BooleanField(default=False)
+
+    @property
+    def content(self):
+        '''File contents, stored in (and loaded from) the Blob'''
+        if getattr(self, '_content', None) is not None:
+            return self._content
+        if self.blob_id is None:
+            return ''
+        return self.blob.content
+
+    @content.setter
+    def content(self, content):
+        # The Blob is looked up or created on save
+        self._content = content
+
+    @property
+    def hash(self):
+        '''SHA-256 hash of the file contents'''
+        if getattr(self, '_content', None) is not None:
+            return hashlib.sha256(self._content.encode('utf-8')).hexdigest()
+        return self.blob_id
+
+    def save(self, *args, **kwargs):
+        if getattr(self, '_content', None) is not None or self.blob_id is None:
+            self.blob = Blob.store(self.content)
+            self._content = None
+        super(File, self).save(*args, **kwargs)
     
     def __str__(self):
         return str(self.name) + ' (id=' + str(self.id) + ') @ App "' + str(self.app.name) + '" of user ' + str(self.app.user.email)
@@ -59,6 +109,7 @@ class Commit(models.Model):
     tag    = models.CharField('Tag', max_length=36, blank=True, null=True)
     files  = models.ManyToManyField(File)
     valid  = models.BooleanField(default=False)
+    bundle = models.ForeignKey(Blob, related_name='+', null=True, blank=True, on_delete=models.PROTECT) # Rendered once for all the processes
 
     def save(self, *args, **kwargs):
         if not self.cid:
@@ -99,6 +150,8 @@ class Settings(models.Model):
     app_version         = models.CharField('App version', max_length=36, blank=False, null=False)
     app_tag             = models.CharField('App tag', max_length=36, blank=True, null=True)
     management_interval = models.CharField('Management interval', max_length=36, blank=False, null=False)
+    management_interval_min = models.IntegerField('Management interval lower bound (adaptive)', blank=True, null=True)
+    management_interval_max = models.IntegerField('Management interval upper bound (adaptive)', blank=True, null=True)
     #management_sync     = models.BooleanField('Sync management execution', default=False)
     worker_interval     = models.CharField('Worker interval', max_length=36, blank=False, null=False)
     #worker_sync         = models.BooleanField('Sync worker execution', default=False)
@@ -134,6 +187,23 @@ class Pool(models.Model):
         return str('Pool "{}" of App "{}" of user "{}" with settings id "{}"'.format(self.name,self.app.name,self.app.user.email, self.settings.id))
 
 
+class Rollout(models.Model):
+    '''Staged rollout of a new App version on a pool: only a (growing) percentage of the Things gets the new version'''
+    pool         = models.ForeignKey(Pool, related_name='+')
+    from_version = models.CharField('From App version', max_length=36)
+    to_version   = models.CharField('To App version', max_length=36)
+    started      = models.DateTimeField('Rollout start timestamp', default=timezone.now)
+    updated      = models.DateTimeField('Rollout last update timestamp', default=timezone.now)
+    percentage   = models.FloatField('Percentage of Things exposed to the new version', default=0)
+    status       = models.CharField('Rollout status', max_length=36, default='Running') # Running|Paused|Completed|Superseded|Cancelled
+
+    class Meta:
+        index_together = (('pool', 'status'),)
+
+    def __str__(self):
+        return str('Rollout of App version "{}" on pool "{}" ({}, {}%)'.format(self.to_version, self.pool.name, self.status, self.percentage))
+
+
 
 #=========================
 #  Thing 
@@ -203,6 +273,7 @@ class Session(models.Model):
     # Keys
     key   = models.CharField('Key', max_length=512, blank=True, null=True)   #512 chars, NOT bits!!!
     kty   = models.CharField('Key type', max_length=36, blank=True, null=True)
+    ken   = models.CharField('Key encryption', max_length=36, blank=True, null=True)
 
     def __str__(self):
         if self.thing:
@@ -277,27 +348,50 @@ class WorkerMessageHandler(object):
         WorkerMessage.objects.filter(aid=aid, tid=tid).delete()
 
 
-class ManagementMessage(models.Model): # TODO: rename to ManagementMessages 
+class ManagementMessageBase(models.Model):
     aid      = models.CharField('App ID', max_length=36, blank=False, null=False)
     tid      = models.CharField('Thing ID', max_length=36, blank=False, null=False)
     ts       = models.DateTimeField('Message timestamp', default=timezone.now, blank=True)
     uuid     = models.CharField('Message uuid', max_length=36)
-    status   = models.CharField('Message status', max_length=36, default='Queued')
+    status   = models.CharField('Message status', max_length=36, default='Queued') # Queued | Delivered | Received | Expired
     type     = models.CharField('Message status', max_length=36, default='APP')
     thing    = models.ForeignKey(Thing, null=True) # Used only for CMD management messages. Remvoe me?
     data     = JSONField(blank=True, null=True)
     reply    = JSONField(blank=True, null=True)
+    ttl      = models.IntegerField('Message TTL (s)', blank=True, null=True)
+    expires  = models.DateTimeField('Message expiration timestamp', blank=True, null=True)
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return str('Message from Thing with TID "{}" on App with AID "{}" received at {}'.format(self.tid, self.aid, self.ts))
+
+
+class ManagementMessage(ManagementMessageBase): # TODO: rename to ManagementMessages 
+    '''Live management messages queue. Completed (received or expired) messages are moved to the ManagementMessageHistory.'''
 
     def save(self, *args, **kwargs):
         if not self.uuid:
             self.uuid = str(uuid.uuid4())
+        if self.ttl is None:
+            self.ttl = django_settings.MANAGEMENT_MESSAGE_DEFAULT_TTL
+        if self.ttl and not self.expires:
+            self.expires = self.ts + timedelta(seconds=self.ttl)
         super(ManagementMessage, self).save(*args, **kwargs)
  
     class Meta:
         unique_together = (("tid", "uuid"),)  
+        index_together = (("tid", "status", "ts"), ("thing", "type", "ts"))
 
-    def __str__(self):
-        return str('Message from Thing with TID "{}" on App with AID "{}" received at {}'.format(self.tid, self.aid, self.ts))
+
+class ManagementMessageHistory(ManagementMessageBase):
+    '''Completed management messages, moved here from the live queue'''
+    archived = models.DateTimeField('Archived timestamp', default=timezone.now, db_index=True)
+
+    class Meta:
+        unique_together = (("tid", "uuid"),)
+        index_together = (("thing", "type", "ts"), ("tid", "ts"))
 
 
 
@@ -316,6 +410,7 @@ class Profile(models.Model):
     type_id = models.IntegerField('Profile Type ID', default=10)
     email_updates = models.BooleanField(default=False)
     last_accepted_terms = models.FloatField('Last accepted TOS', default=0)
+    last_activity = models.DateTimeField('Last dashboard activity', blank=True, null=True)
 
 
     def save(self, *args, **kwargs):
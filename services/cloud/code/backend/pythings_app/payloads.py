@@ -0,0 +1,139 @@
+import json
+import zlib
+import hashlib
+import logging
+
+# Django imports
+from django.conf import settings
+
+# Backend imports
+from ..common.cache import LRUCache
+from .models import Blob
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+#=========================
+#  Payloads
+#=========================
+
+class Payload(object):
+    '''A rendered, immutable download payload, with its precompressed (zlib) variant'''
+
+    def __init__(self, content):
+        self.content = content
+        self.data = content.encode('utf-8')
+        self.size = len(self.data)
+        self.hash = hashlib.sha256(self.data).hexdigest()
+        self.deflated = zlib.compress(self.data, 9)
+
+    @property
+    def cache_size(self):
+        return self.size + len(self.content) + len(self.deflated)
+
+
+# Rendered App code payloads, by (commit id, file name, prologue), and bundles by (commit id, None, 'bundle').
+# Commits are immutable, so they never get stale.
+app_payloads_cache = LRUCache(max_bytes=settings.PAYLOADS_CACHE_MAX_BYTES)
+
+# App commits file manifests, by commit id
+app_manifests_cache = LRUCache(max_items=1000)
+
+# PythingsOS dist files payloads, by (file path, validator). A changed file gets a new validator, hence a new entry.
+dist_payloads_cache = LRUCache(max_bytes=settings.PAYLOADS_CACHE_MAX_BYTES)
+
+
+#=========================
+#  App code
+#=========================
+
+def render_app_payload(commit, file_name=None, prologue=True):
+    '''Render the code of an App commit as downloaded by the Things: a single file, with or without the
+    logger and sensors prologue, or all the files pasted together (old behavior) if no file name is given.'''
+
+    version = '\nversion=\'{}\''.format(commit.cid)
+
+    if file_name:
+        parts = []
+        if prologue:
+            # Extra: logger and sensors
+            parts.append('import logger\n')
+            if 'worker' in file_name:
+                parts.append('try:\n    import sensors\nexcept ImportError:\n    pass\n\n')
+        for file in commit.files.select_related('blob').filter(name=file_name):
+            parts.append(file.content)
+            parts.append(version)
+    else:
+        parts = ['import logger\n']
+        for file in commit.files.select_related('blob'):
+            parts.append(file.content)
+        parts.append(version)
+
+    return ''.join(parts)
+
+
+def get_app_payload(commit, file_name=None, prologue=True):
+    '''Get the payload of (a file of) an App commit, rendering it only if not already cached'''
+    return app_payloads_cache.get_or_set((commit.id, file_name, prologue),
+                                         lambda: Payload(render_app_payload(commit, file_name, prologue)),
+                                         sizeof=lambda payload: payload.cache_size)
+
+
+def prerender_app_payloads(commit):
+    '''Pre-render all the payloads of an App commit (to be called once the commit is created). The payloads are cached
+    in this process only, while the bundle is also stored so that the other processes do not have to render it.'''
+    for file_name in commit.files.values_list('name', flat=True):
+        get_app_payload(commit, file_name)
+        get_app_payload(commit, file_name, prologue=False)
+    get_app_payload(commit)
+    bundle = get_app_bundle(commit)
+    if not commit.bundle_id:
+        commit.bundle = Blob.store(bundle.content)
+        commit.save(update_fields=['bundle'])
+
+
+#=========================
+#  App manifests
+#=========================
+
+def get_app_manifest(commit):
+    '''Get the manifest of an App commit. For each file: name, size and hash (SHA-256) of the payload as downloaded
+    (prologue and version included), to check the downloads, and content_hash of the file source only, which does
+    not change across versions unless the file does and is the one to compare with the files a Thing already has.'''
+    def create():
+        manifest = []
+        for file in commit.files.all():
+            payload = get_app_payload(commit, file.name)
+            manifest.append({'name': file.name, 'size': payload.size, 'hash': payload.hash, 'content_hash': file.hash})
+        return manifest
+    return app_manifests_cache.get_or_set(commit.id, create)
+
+
+def diff_app_manifest(manifest, have):
+    '''Compare a manifest with the files a Thing already has (as name -> content hash), returning the
+    entries of the files to be downloaded and the names of the files to be removed.'''
+    changed = [entry for entry in manifest if have.get(entry['name'], None) != entry['content_hash']]
+    removed = sorted(set(have) - set(entry['name'] for entry in manifest))
+    return changed, removed
+
+
+#=========================
+#  App bundles
+#=========================
+
+def render_app_bundle(commit):
+    '''Render the bundle of an App commit: a single-line JSON header with the version and the manifest, followed by the
+    payloads of all the files (with prologue) one after another, in the same order and with the sizes of the manifest.'''
+    manifest = get_app_manifest(commit)
+    parts = [json.dumps({'version': commit.cid, 'files': manifest}, separators=(',', ':')), '\n']
+    for entry in manifest:
+        parts.append(get_app_payload(commit, entry['name']).content)
+    return ''.join(parts)
+
+
+def get_app_bundle(commit):
+    '''Get the bundle of an App commit, loading it from the storage (or rendering it) only if not already cached'''
+    return app_payloads_cache.get_or_set((commit.id, None, 'bundle'),
+                                         lambda: Payload(commit.bundle.content if commit.bundle_id else render_app_bundle(commit)),
+                                         sizeof=lambda payload: payload.cache_size)
@@ -101,7 +101,7 @@ class BaseAPITestCase(TestCase):
         is_json = False
 
         if 'content-type' in self.response._headers:
-            is_json = bool(filter(lambda x: 'json' in x, self.response._headers['content-type']))
+            is_json = any('json' in x for x in self.response._headers['content-type'])
 
         if is_json and self.response.content:
             self.response.json = json.loads(self.response.content)
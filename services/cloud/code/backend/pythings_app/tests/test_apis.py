@@ -1,11 +1,29 @@
+import os
 import json
+import time
+import hmac
+import shutil
+import tempfile
+import threading
+from unittest import skipUnless
+import zlib
+import hashlib
 import logging
+from unittest import mock
 from datetime import timedelta
         
 from .common import BaseAPITestCase
 from django.contrib.auth.models import User
-from ...pythings_app.models import WorkerMessage, ManagementMessage, App, Thing, Pool, Settings, Profile, WorkerMessageHandler, MessageCounter
+from django.test import TransactionTestCase, override_settings
+from django.db import connection
+from ...pythings_app.models import WorkerMessage, ManagementMessage, File, Commit, Session, App, Thing, Pool, Settings, Profile, WorkerMessageHandler, MessageCounter
 from ...common.time import dt
+from ...pythings_app.crypto_aes import Aes128ecb
+from ...pythings_app.crypto_aes_gcm import Aes128gcm
+from ...pythings_app.dist import DistIndex
+from ...pythings_app import apis_v1
+from ...common.returns import encrypted_response, encrypted_payloads_cache, _cached_stream
+from ...pythings_app.helpers import notify_shell, poll_activity_cache, touch_user_activity
 
 # Logging
 logging.basicConfig(level=logging.ERROR)
@@ -130,7 +148,107 @@ class TestApi(BaseAPITestCase):
         self.assertEqual(content_dict['reply'], None)
 
 
-    def test_api_web_worker(self):        
+    def test_api_web_msg_management_batch(self):
+
+        # Post two management messages
+        mids = []
+        for msg in ['test #1', 'test #2']:
+            resp = self.post('/api/web/v1/msg/management/new', data={'tid': '112233445566', 'msg':msg, 'username': 'testuser', 'password':'testpass'})
+            self.assertEqual(resp.status_code, 200)
+            mids.append(json.loads(resp.content)['mid'])
+
+        # Mark the second one as replied
+        ManagementMessage.objects.filter(uuid=mids[1]).update(status='Received', reply='ok')
+
+        # Get both plus a not existent one in a single request
+        resp = self.post('/api/web/v1/msg/management/get', data={'mids': mids+['not-existent'], 'username': 'testuser', 'password':'testpass'})
+        self.assertEqual(resp.status_code, 200)
+        content_dict = json.loads(resp.content)
+        self.assertEqual(content_dict[mids[0]], {'status': 'Queued', 'reply': None})
+        self.assertEqual(content_dict[mids[1]], {'status': 'Received', 'reply': 'ok'})
+        self.assertEqual(content_dict['not-existent'], None)
+
+        # Wait mode times out and returns the current statuses
+        resp = self.post('/api/web/v1/msg/management/get', data={'mids': mids, 'wait': 0.1, 'username': 'testuser', 'password':'testpass'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.content)[mids[0]]['status'], 'Queued')
+
+        # Expired messages are final, wait mode returns at once
+        ManagementMessage.objects.filter(uuid=mids[0]).update(status='Expired')
+        start = time.time()
+        resp = self.post('/api/web/v1/msg/management/get', data={'mids': mids, 'wait': 5, 'username': 'testuser', 'password':'testpass'})
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(json.loads(resp.content)[mids[0]]['status'], 'Expired')
+
+        # Messages of other users are not accessible
+        resp = self.post('/api/web/v1/msg/management/get', data={'mids': mids, 'username': 'anotheruser', 'password':'anotherpass'})
+        self.assertEqual(json.loads(resp.content), {mids[0]: None, mids[1]: None})
+
+        # Wrong mids format
+        resp = self.post('/api/web/v1/msg/management/get', data={'mids': mids[0], 'username': 'testuser', 'password':'testpass'})
+        self.assertEqual(resp.status_code, 400)
+
+
+    def test_api_web_msg_management_cmd(self):
+
+        # Post a remote shell (CMD) management message
+        resp = self.post('/api/web/v1/msg/management/new', data={'tid': '112233445566', 'msg':'print(1)', 'type': 'CMD', 'username': 'testuser', 'password':'testpass'})
+        self.assertEqual(resp.status_code, 200)
+        management_message = ManagementMessage.objects.get(uuid=json.loads(resp.content)['mid'])
+        self.assertEqual(management_message.type, 'CMD')
+        self.assertEqual(management_message.thing, self.thing)
+
+        # Wrong type
+        resp = self.post('/api/web/v1/msg/management/new', data={'tid': '112233445566', 'msg':'print(1)', 'type': 'XYZ', 'username': 'testuser', 'password':'testpass'})
+        self.assertEqual(resp.status_code, 400)
+
+        # Shell history is private
+        resp = self.post('/api/web/v1/shell/history', data={'tid': '112233445566'})
+        self.assertEqual(resp.status_code, 401)
+
+
+    def test_api_web_shell_history(self):
+
+        # Create some remote shell (CMD) messages, one minute apart
+        from_dt = dt(2016,10,29,15,0,0, tz='UTC')
+        for i in range(5):
+            ManagementMessage.objects.create(aid=self.app.aid, tid=self.thing.tid, thing=self.thing, type='CMD', data='cmd #{}'.format(i), ts=from_dt+timedelta(minutes=i))
+
+        # Bounded scrollback
+        resp = self.post('/api/web/v1/shell/history', data={'tid': '112233445566', 'last': 2, 'username': 'testuser', 'password':'testpass'})
+        self.assertEqual(resp.status_code, 200)
+        content_dict = json.loads(resp.content)
+        self.assertEqual([message['data'] for message in content_dict['messages']], ['cmd #3', 'cmd #4'])
+
+        # Only the messages after the cursor
+        cursor = 1477753200 + 120 # Sat, 29 Oct 2016 15:02:00 GMT
+        resp = self.post('/api/web/v1/shell/history', data={'tid': '112233445566', 'after': cursor, 'username': 'testuser', 'password':'testpass'})
+        content_dict = json.loads(resp.content)
+        self.assertEqual([message['data'] for message in content_dict['messages']], ['cmd #3', 'cmd #4'])
+        self.assertEqual(content_dict['cursor'], 1477753200 + 240)
+
+        # Nothing new after the last one
+        resp = self.post('/api/web/v1/shell/history', data={'tid': '112233445566', 'after': content_dict['cursor'], 'username': 'testuser', 'password':'testpass'})
+        self.assertEqual(json.loads(resp.content)['messages'], [])
+
+        # Pending messages with their status: only the changed ones
+        mids = [message['mid'] for message in content_dict['messages']]
+        resp = self.post('/api/web/v1/shell/history', data={'tid': '112233445566', 'after': content_dict['cursor'], 'pending': {mids[0]: 'Queued', mids[1]: 'Delivered'}, 'username': 'testuser', 'password':'testpass'})
+        self.assertEqual([message['mid'] for message in json.loads(resp.content)['messages']], [mids[1]])
+
+        # Waiting is not possible within a transaction, the request returns at once
+        start = time.time()
+        resp = self.post('/api/web/v1/shell/history', data={'tid': '112233445566', 'after': content_dict['cursor'], 'wait': 5, 'username': 'testuser', 'password':'testpass'})
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual(json.loads(resp.content)['messages'], [])
+        self.assertEqual(json.loads(resp.content)['waited'], False)
+
+        # No access rights for thing
+        resp = self.post('/api/web/v1/shell/history', data={'tid': '112233445566', 'username': 'anotheruser', 'password':'anotherpass'})
+        self.assertEqual(json.loads(resp.content), {"detail": "Not existent Thing or no access rights"})
+
+
+    def test_api_web_worker(self):
         
         # Create sample worker messages, for about a month of hour-data.         
         from_dt = dt(2016,10,29,15,0,0, tz='UTC')
@@ -246,3 +364,353 @@ class TestApi(BaseAPITestCase):
         self.assertEqual(resp.status_code, 401)
 
 
+
+    def test_api_PythingsOS_gcm_session(self):
+
+        # Preregistered session with the AES-128 GCM session cipher
+        Session.objects.create(token='a1b2c3d4', key='1234567890', kty='aes128', ken='srsa1-aes128gcm')
+        aes128gcm = Aes128gcm(key=1234567890)
+
+        # Register the Thing with base64 framing
+        encrypted = aes128gcm.encrypt_text(json.dumps({'tid': '112233445566', 'aid': 'rh398rh20cr9h209rh2r2092j1d39f27ex'}))
+        resp = self.post('/api/v1/things/register/', data={'token': 'a1b2c3d4', 'encrypted': encrypted})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(aes128gcm.decrypt_text(resp.content.decode('utf-8')))['token'], 'a1b2c3d4')
+
+        # Post a worker message with raw-body framing, and get a raw-body response
+        encrypted = aes128gcm.encrypt_bytes(json.dumps({'msg': {'label_one': 13.56}}).encode('utf-8'))
+        resp = self.client.post('/api/v1/apps/worker/', data=encrypted, content_type='application/octet-stream', HTTP_X_PYTHINGS_TOKEN='a1b2c3d4')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Type'], 'application/octet-stream')
+        aes128gcm.decrypt_bytes(resp.content)
+        worker_messages = WorkerMessageHandler.get(tid = '112233445566', aid = 'rh398rh20cr9h209rh2r2092j1d39f27ex')
+        self.assertEqual(worker_messages[0].data['label_one'], 13.56)
+
+        # Tampered (a flipped tag byte) or truncated data is rejected
+        resp = self.client.post('/api/v1/apps/worker/', data=encrypted[:-1]+bytes([encrypted[-1]^1]), content_type='application/octet-stream', HTTP_X_PYTHINGS_TOKEN='a1b2c3d4')
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.post('/api/v1/apps/worker/', data=encrypted[:8], content_type='application/octet-stream', HTTP_X_PYTHINGS_TOKEN='a1b2c3d4')
+        self.assertEqual(resp.status_code, 400)
+        tampered = aes128gcm.encrypt_text(json.dumps({'msg': {'label_one': 13.56}}))
+        resp = self.post('/api/v1/apps/worker/', data={'token': 'a1b2c3d4', 'encrypted': tampered[:-4]+('AAAA' if tampered[-4:] != 'AAAA' else 'BBBB')})
+        self.assertEqual(resp.status_code, 400)
+
+        # Raw-body framing is not supported for the AES-128 ECB sessions
+        Session.objects.create(token='e5f6a7b8', key='1234567890', kty='aes128', ken='srsa1')
+        resp = self.client.post('/api/v1/apps/worker/', data=encrypted, content_type='application/octet-stream', HTTP_X_PYTHINGS_TOKEN='e5f6a7b8')
+        self.assertEqual(resp.status_code, 400)
+
+
+    @override_settings(STREAMING_RESPONSE_MIN_SIZE=10, STREAMING_RESPONSE_CHUNK_BLOCKS=2)
+    def test_api_PythingsOS_streaming(self):
+
+        # Preregistered session with the (comp_mode) AES-128 ECB session cipher
+        Session.objects.create(token='a1b2c3d4', key='1234567890', kty='aes128', ken='srsa1')
+        aes128ecb = Aes128ecb(key=1234567890, comp_mode=True)
+
+        # Register the Thing, the encrypted response is streamed with its length known in advance
+        encrypted = aes128ecb.encrypt_text(json.dumps({'tid': '112233445566', 'aid': 'rh398rh20cr9h209rh2r2092j1d39f27ex'}))
+        resp = self.client.post('/api/v1/things/register/', data=json.dumps({'token': 'a1b2c3d4', 'encrypted': encrypted}), content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.streaming)
+        content = b''.join(resp.streaming_content)
+        self.assertEqual(int(resp['Content-Length']), len(content))
+        self.assertEqual(json.loads(aes128ecb.decrypt_text(content.decode('utf-8')))['token'], 'a1b2c3d4')
+
+        # A cached stream is cached only once fully streamed, not if the Thing goes away in the middle
+        text = 'print(1)\n' * 10
+        stream = _cached_stream(aes128ecb.encrypt_text_stream(text, 2), 'test_streaming')
+        next(stream)
+        stream.close()
+        self.assertNotIn('test_streaming', encrypted_payloads_cache)
+        resp = encrypted_response(aes128ecb, text, cache_key='test_streaming')
+        content = b''.join(resp.streaming_content)
+        self.assertEqual(encrypted_payloads_cache.get('test_streaming'), content.decode('utf-8'))
+        self.assertEqual(aes128ecb.decrypt_text(content.decode('utf-8')), text)
+
+
+    def test_api_PythingsOS_apps_encrypted_cache(self):
+
+        # Create a commit
+        commit = Commit.objects.create(app=self.app, cid='1')
+        commit.files.add(File.objects.create(name='worker_task.py', app=self.app, content='print(1)', committed=True))
+
+        # Preregistered session, and register the Thing
+        Session.objects.create(token='a1b2c3d4', key='1234567890', kty='aes128', ken='srsa1')
+        aes128ecb = Aes128ecb(key=1234567890, comp_mode=True)
+        encrypted = aes128ecb.encrypt_text(json.dumps({'tid': '112233445566', 'aid': 'rh398rh20cr9h209rh2r2092j1d39f27ex'}))
+        resp = self.post('/api/v1/things/register/', data={'token': 'a1b2c3d4', 'encrypted': encrypted})
+        self.assertEqual(resp.status_code, 200)
+
+        # First encrypted download
+        encrypted = aes128ecb.encrypt_text(json.dumps({'version': '1', 'file_name': 'worker_task.py'}))
+        resp = self.post('/api/v1/apps/get/', data={'token': 'a1b2c3d4', 'encrypted': encrypted})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('print(1)', aes128ecb.decrypt_text(resp.content.decode('utf-8')))
+        encrypted_content = resp.content
+
+        # Retried download, served from the cache without encrypting again
+        with mock.patch.object(Aes128ecb, 'encrypt_text', side_effect=AssertionError('Encrypted again')):
+            resp = self.post('/api/v1/apps/get/', data={'token': 'a1b2c3d4', 'encrypted': encrypted})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, encrypted_content)
+
+        # Ranged encrypted download, in characters and with the chunk hash bound to the session key
+        encrypted = aes128ecb.encrypt_text(json.dumps({'version': '1', 'file_name': 'worker_task.py', 'offset': 0, 'length': 6}))
+        resp = self.post('/api/v1/apps/get/', data={'token': 'a1b2c3d4', 'encrypted': encrypted})
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(aes128ecb.decrypt_text(resp.content.decode('utf-8')), 'import')
+        self.assertTrue(resp['Content-Range'].startswith('chars 0-5/'))
+        self.assertNotIn('X-Chunk-SHA256', resp)
+        self.assertEqual(resp['X-Chunk-HMAC-SHA256'], hmac.new(b'1234567890', b'import', hashlib.sha256).hexdigest())
+
+
+    def test_api_PythingsOS_pythings_encrypted_cache(self):
+
+        # Create a dist tree with two files of the same size (and modification time)
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        os.makedirs(os.path.join(root, 'v1.0', 'esp8266'))
+        with open(os.path.join(root, 'v1.0', 'esp8266', 'files.txt'), 'w') as f:
+            f.write('1:8:main.py\n2:8:boot.py\n')
+        for file_name, content in [('main.py', 'print(1)'), ('boot.py', 'print(2)')]:
+            with open(os.path.join(root, 'v1.0', 'esp8266', file_name), 'w') as f:
+                f.write(content)
+            os.utime(os.path.join(root, 'v1.0', 'esp8266', file_name), (1000000000, 1000000000))
+
+        # Preregistered session, and register the Thing
+        Session.objects.create(token='a1b2c3d4', key='1234567890', kty='aes128', ken='srsa1')
+        aes128ecb = Aes128ecb(key=1234567890, comp_mode=True)
+        encrypted = aes128ecb.encrypt_text(json.dumps({'tid': '112233445566', 'aid': 'rh398rh20cr9h209rh2r2092j1d39f27ex'}))
+        resp = self.post('/api/v1/things/register/', data={'token': 'a1b2c3d4', 'encrypted': encrypted})
+        self.assertEqual(resp.status_code, 200)
+
+        # Each file gets its own content, also when the second one would be served from the encrypted payloads cache
+        with mock.patch.object(apis_v1, 'dist_index', DistIndex(root)):
+            for file_name, content in [('main.py', 'print(1)'), ('boot.py', 'print(2)'), ('main.py', 'print(1)')]:
+                encrypted = aes128ecb.encrypt_text(json.dumps({'version': 'v1.0', 'platform': 'esp8266', 'file_name': file_name}))
+                resp = self.post('/api/v1/pythings/get/', data={'token': 'a1b2c3d4', 'encrypted': encrypted})
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(aes128ecb.decrypt_text(resp.content.decode('utf-8')), content)
+
+
+    def test_api_PythingsOS_management_poll_hint(self):
+        poll_activity_cache.clear()
+
+        # Register the Thing
+        resp = self.post('/api/v1/things/register/', data={'tid': '112233445566', 'aid': 'rh398rh20cr9h209rh2r2092j1d39f27ex'})
+        token = json.loads(resp.content)['token']
+
+        # No adaptive bounds set: the hint is just the management interval
+        resp = self.post('/api/v1/apps/management/', data={'token': token})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.content)['next_poll_s'], 300)
+
+        # Set adaptive bounds: without any activity the Thing is backed off to the maximum
+        self.settings.management_interval_min = 10
+        self.settings.management_interval_max = 3600
+        self.settings.save()
+        resp = self.post('/api/v1/apps/management/', data={'token': token})
+        self.assertEqual(json.loads(resp.content)['next_poll_s'], 3600)
+
+        # With recent management activity, the Thing polls at the minimum
+        ManagementMessage.objects.create(aid=self.app.aid, tid=self.thing.tid, data='test')
+        resp = self.post('/api/v1/apps/management/', data={'token': token})
+        self.assertEqual(json.loads(resp.content)['next_poll_s'], 10)
+
+        # Only the live queue is read again, the history and the dashboard activity are taken from the cache
+        self.assertIn(('thing', self.thing.tid), poll_activity_cache)
+        self.assertIn(('user', self.user.id), poll_activity_cache)
+
+        # Dashboard activity is written at most once a minute (per process)
+        with self.assertNumQueries(1):
+            touch_user_activity(self.user)
+            touch_user_activity(self.user)
+
+
+    def test_api_PythingsOS_apps_manifest(self):
+
+        # Create two commits, where only the worker task changes
+        management_task = File.objects.create(name='management_task.py', app=self.app, content='print(1)', committed=True)
+        commit1 = Commit.objects.create(app=self.app, cid='1')
+        commit1.files.add(management_task)
+        commit1.files.add(File.objects.create(name='worker_task.py', app=self.app, content='print(2)', committed=True))
+        commit2 = Commit.objects.create(app=self.app, cid='2')
+        commit2.files.add(management_task)
+        commit2.files.add(File.objects.create(name='worker_task.py', app=self.app, content='print(3)', committed=True))
+
+        # Register the Thing
+        resp = self.post('/api/v1/things/register/', data={'tid': '112233445566', 'aid': 'rh398rh20cr9h209rh2r2092j1d39f27ex'})
+        token = json.loads(resp.content)['token']
+
+        # Old behavior: just the file names
+        resp = self.post('/api/v1/apps/get/', data={'token': token, 'version': '2', 'list': True})
+        self.assertEqual(sorted(json.loads(resp.content)), ['management_task.py', 'worker_task.py'])
+
+        # Full manifest
+        resp = self.post('/api/v1/apps/get/', data={'token': token, 'version': '2', 'list': True, 'manifest': True})
+        manifest = json.loads(resp.content)
+        self.assertEqual(manifest['version'], '2')
+        self.assertEqual(len(manifest['files']), 2)
+        self.assertEqual(manifest['removed'], [])
+
+        # Only the changed files, from the hashes the Thing has
+        have = {'management_task.py': management_task.hash, 'worker_task.py': 'oldhash', 'old_task.py': 'oldhash'}
+        resp = self.post('/api/v1/apps/get/', data={'token': token, 'version': '2', 'list': True, 'have': have})
+        manifest = json.loads(resp.content)
+        self.assertEqual([entry['name'] for entry in manifest['files']], ['worker_task.py'])
+        self.assertEqual(manifest['removed'], ['old_task.py'])
+
+        # Only the changed files, from the version the Thing runs
+        resp = self.post('/api/v1/apps/get/', data={'token': token, 'version': '2', 'list': True, 'from_version': '1'})
+        manifest = json.loads(resp.content)
+        self.assertEqual([entry['name'] for entry in manifest['files']], ['worker_task.py'])
+        payload = 'import logger\ntry:\n    import sensors\nexcept ImportError:\n    pass\n\nprint(3)\nversion=\'2\''
+        self.assertEqual(manifest['files'][0]['size'], len(payload))
+        self.assertEqual(manifest['files'][0]['hash'], hashlib.sha256(payload.encode('utf-8')).hexdigest())
+        self.assertEqual(manifest['files'][0]['content_hash'], hashlib.sha256(b'print(3)').hexdigest())
+
+
+    def test_api_PythingsOS_apps_etag(self):
+
+        # Create a commit
+        commit = Commit.objects.create(app=self.app, cid='1')
+        commit.files.add(File.objects.create(name='worker_task.py', app=self.app, content='print(1)', committed=True))
+
+        # Register the Thing
+        resp = self.post('/api/v1/things/register/', data={'tid': '112233445566', 'aid': 'rh398rh20cr9h209rh2r2092j1d39f27ex'})
+        token = json.loads(resp.content)['token']
+
+        # First download, with ETag
+        resp = self.post('/api/v1/apps/get/', data={'token': token, 'version': '1', 'file_name': 'worker_task.py'})
+        self.assertEqual(resp.status_code, 200)
+        etag = resp['ETag']
+
+        # Download again with the ETag, via header or payload
+        resp = self.post('/api/v1/apps/get/', data={'token': token, 'version': '1', 'file_name': 'worker_task.py'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.content, b'')
+        resp = self.post('/api/v1/apps/get/', data={'token': token, 'version': '1', 'file_name': 'worker_task.py', 'etag': etag.strip('"')})
+        self.assertEqual(resp.status_code, 304)
+
+        # The GET (without prologue) has a different ETag
+        resp = self.client.get('/api/v1/apps/get/', {'token': token, 'version': '1', 'file': 'worker_task.py'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, b"print(1)\nversion='1'")
+        resp = self.client.get('/api/v1/apps/get/', {'token': token, 'version': '1', 'file': 'worker_task.py'}, HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp.status_code, 304)
+
+
+    def test_api_PythingsOS_apps_deflate(self):
+
+        # Create a commit
+        commit = Commit.objects.create(app=self.app, cid='1')
+        commit.files.add(File.objects.create(name='worker_task.py', app=self.app, content='print(1)\n'*100, committed=True))
+
+        # Register the Thing
+        resp = self.post('/api/v1/things/register/', data={'tid': '112233445566', 'aid': 'rh398rh20cr9h209rh2r2092j1d39f27ex'})
+        token = json.loads(resp.content)['token']
+
+        # Not capable
+        resp = self.post('/api/v1/apps/get/', data={'token': token, 'version': '1', 'file_name': 'worker_task.py'})
+        self.assertFalse(resp.has_header('Content-Encoding'))
+        content = resp.content
+
+        # Capable as per Accept-Encoding
+        resp = self.post('/api/v1/apps/get/', data={'token': token, 'version': '1', 'file_name': 'worker_task.py'}, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(resp['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(resp.content), content)
+        self.assertTrue(len(resp.content) < len(content))
+
+        # Capable as per the Thing capabilities
+        self.thing.capabilities = 'zlib'
+        self.thing.save()
+        resp = self.post('/api/v1/apps/get/', data={'token': token, 'version': '1', 'file_name': 'worker_task.py'})
+        self.assertEqual(resp['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(resp.content), content)
+
+
+    def test_api_PythingsOS_apps_range(self):
+
+        # Create a commit
+        commit = Commit.objects.create(app=self.app, cid='1')
+        commit.files.add(File.objects.create(name='management_task.py', app=self.app, content='print(1)', committed=True))
+
+        # Register the Thing
+        resp = self.post('/api/v1/things/register/', data={'tid': '112233445566', 'aid': 'rh398rh20cr9h209rh2r2092j1d39f27ex'})
+        token = json.loads(resp.content)['token']
+
+        # Range header (GET)
+        resp = self.client.get('/api/v1/apps/get/', {'token': token, 'version': '1', 'file': 'management_task.py'}, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.content, b'int(')
+        self.assertEqual(resp['Content-Range'], 'bytes 2-5/20')
+        self.assertEqual(resp['X-Chunk-SHA256'], hashlib.sha256(b'int(').hexdigest())
+
+        # Suffix range (GET)
+        resp = self.client.get('/api/v1/apps/get/', {'token': token, 'version': '1', 'file': 'management_task.py'}, HTTP_RANGE='bytes=-4')
+        self.assertEqual(resp.content, b"='1'")
+
+        # Offset and length (POST), resuming till the end
+        resp = self.post('/api/v1/apps/get/', data={'token': token, 'version': '1', 'file_name': 'management_task.py', 'offset': 14, 'length': 100})
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.content, b"print(1)\nversion='1'")
+
+        # Out of range
+        resp = self.post('/api/v1/apps/get/', data={'token': token, 'version': '1', 'file_name': 'management_task.py', 'offset': 1000})
+        self.assertEqual(resp.status_code, 416)
+
+
+    def test_api_PythingsOS_apps_bundle(self):
+
+        # Create a commit
+        commit = Commit.objects.create(app=self.app, cid='1')
+        commit.files.add(File.objects.create(name='worker_task.py', app=self.app, content='print(1)', committed=True))
+        commit.files.add(File.objects.create(name='management_task.py', app=self.app, content='print(2)', committed=True))
+
+        # Register the Thing
+        resp = self.post('/api/v1/things/register/', data={'tid': '112233445566', 'aid': 'rh398rh20cr9h209rh2r2092j1d39f27ex'})
+        token = json.loads(resp.content)['token']
+
+        # Get the bundle and split it as per its header
+        resp = self.post('/api/v1/apps/get/', data={'token': token, 'version': '1', 'bundle': True})
+        self.assertEqual(resp.status_code, 200)
+        header, data = resp.content.split(b'\n', 1)
+        header = json.loads(header.decode('utf-8'))
+        self.assertEqual(header['version'], '1')
+        for entry in header['files']:
+            resp = self.post('/api/v1/apps/get/', data={'token': token, 'version': '1', 'file_name': entry['name']})
+            self.assertEqual(data[0:entry['size']], resp.content)
+            data = data[entry['size']:]
+        self.assertEqual(data, b'')
+
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Remote shell push requires Postgres')
+class TestShellPush(TransactionTestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('testuser', password='testpass')
+        Profile.objects.create(user=self.user)
+        app = App.objects.create(aid='rh398rh20cr9h209rh2r2092j1d39f27ex', name='Test App', user=self.user)
+        settings = Settings.objects.create(pythings_version='v0.1', app_version='v0.4', management_interval='300', worker_interval='60')
+        self.thing = Thing.objects.create(tid='112233445566', app=app, pool=Pool.objects.create(app=app, settings=settings))
+
+    def test_api_web_shell_history_wait(self):
+
+        # Send a command while the shell is waiting
+        def send_command():
+            time.sleep(0.5)
+            notify_shell(ManagementMessage.objects.create(aid=self.thing.app.aid, tid=self.thing.tid, thing=self.thing, type='CMD', data='print(1)'))
+            connection.close()
+        sender = threading.Thread(target=send_command)
+        sender.start()
+
+        # It is pushed, without waiting for the whole timeout
+        start = time.time()
+        resp = self.client.post('/api/web/v1/shell/history', data=json.dumps({'tid': '112233445566', 'after': time.time(), 'wait': 10, 'username': 'testuser', 'password':'testpass'}), content_type='application/json')
+        sender.join()
+        self.assertLess(time.time() - start, 5)
+        content_dict = json.loads(resp.content.decode('utf-8'))
+        self.assertEqual(content_dict['waited'], True)
+        self.assertEqual([(message['data'], message['status']) for message in content_dict['messages']], [('print(1)', 'Queued')])
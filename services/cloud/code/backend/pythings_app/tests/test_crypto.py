@@ -0,0 +1,172 @@
+import random
+import hashlib
+import string
+import logging
+from unittest import TestCase, skipUnless
+
+from backend.pythings_app.crypto_engine_aes128ecb import Aes128ecb_engine, Aes128ecb_ttable_engine
+from backend.pythings_app.crypto_engine_aes128ecb_native import Aes128ecb_native_engine
+from backend.pythings_app.crypto_engine_aes128ecb_native import available as native_available
+from backend.pythings_app.crypto_aes import Aes128ecb
+from backend.pythings_app.crypto_aes_gcm import Aes128gcm
+from backend.pythings_app.crypto_aes_gcm import available as aes_gcm_available
+from backend.pythings_app.crypto_rsa import Srsa, pow3, multinv, recover_primes
+
+# Logging
+logging.basicConfig(level=logging.ERROR)
+logger = logging.getLogger('backend')
+
+
+class CryptoTests(TestCase):
+
+    def setUp(self):
+        random.seed(42)
+
+    def test_Aes128ecb_ttable_engine(self):
+
+        # FIPS-197 (Appendix C.1) test vector
+        engine = Aes128ecb_ttable_engine(0x000102030405060708090a0b0c0d0e0f)
+        self.assertEqual(engine.encrypt(0x00112233445566778899aabbccddeeff), 0x69c4e0d86a7b0430d8cdb78070b4c55a)
+        self.assertEqual(engine.decrypt(0x69c4e0d86a7b0430d8cdb78070b4c55a), 0x00112233445566778899aabbccddeeff)
+
+        # Same results as the original engine, on random keys and blocks
+        for _ in range(100):
+            key = random.getrandbits(128)
+            block = random.getrandbits(128)
+            engine = Aes128ecb_ttable_engine(key)
+            reference_engine = Aes128ecb_engine(key)
+            self.assertEqual(engine.encrypt(block), reference_engine.encrypt(block))
+            self.assertEqual(engine.decrypt(block), reference_engine.decrypt(block))
+
+    def test_Aes128ecb(self):
+
+        # Encrypt and decrypt back, in both modes
+        for comp_mode in [True, False]:
+            aes128ecb = Aes128ecb(key=random.getrandbits(128), comp_mode=comp_mode)
+            text = '{"token": "3f9a", "msg": "Hello world!"}'
+            self.assertEqual(aes128ecb.decrypt_text(aes128ecb.encrypt_text(text)), text)
+
+    @skipUnless(native_available, 'The cryptography package is not installed')
+    def test_Aes128ecb_native_engine(self):
+
+        # FIPS-197 (Appendix C.1) test vector
+        engine = Aes128ecb_native_engine(0x000102030405060708090a0b0c0d0e0f)
+        self.assertEqual(engine.encrypt(0x00112233445566778899aabbccddeeff), 0x69c4e0d86a7b0430d8cdb78070b4c55a)
+
+        # Same results as the pure-Python engine, on random keys and blocks
+        for _ in range(100):
+            key = random.getrandbits(128)
+            block = random.getrandbits(128)
+            self.assertEqual(Aes128ecb_native_engine(key).encrypt(block), Aes128ecb_ttable_engine(key).encrypt(block))
+            self.assertEqual(Aes128ecb_native_engine(key).decrypt(block), Aes128ecb_ttable_engine(key).decrypt(block))
+
+    @skipUnless(native_available, 'The cryptography package is not installed')
+    def test_Aes128ecb_backends(self):
+
+        # Same wire format with both backends, in both modes, on random keys and texts
+        for comp_mode in [True, False]:
+            for _ in range(50):
+                key = random.getrandbits(128)
+                text = ''.join(random.choice(string.printable) for _ in range(random.randint(1, 200)))
+                native = Aes128ecb(key=key, comp_mode=comp_mode, backend='native')
+                python = Aes128ecb(key=key, comp_mode=comp_mode, backend='python')
+                encrypted_text = native.encrypt_text(text)
+                self.assertEqual(encrypted_text, python.encrypt_text(text))
+                self.assertEqual(native.decrypt_text(encrypted_text), python.decrypt_text(encrypted_text))
+
+    def test_Aes128ecb_blocks(self):
+
+        # Batch encryption and decryption give the same results as block by block, with all the engines
+        engines = [Aes128ecb_engine, Aes128ecb_ttable_engine]
+        if native_available:
+            engines.append(Aes128ecb_native_engine)
+        key = random.getrandbits(128)
+        blocks = [random.getrandbits(128) for _ in range(50)]
+        for engine in [engine_class(key) for engine_class in engines]:
+            self.assertEqual(engine.encrypt_blocks(blocks), [engine.encrypt(block) for block in blocks])
+            self.assertEqual(engine.decrypt_blocks(blocks), [engine.decrypt(block) for block in blocks])
+            self.assertEqual(engine.encrypt_blocks([]), [])
+
+        # Whole texts are encrypted as their streams, in both modes and by any number of blocks at a time
+        for comp_mode in [True, False]:
+            aes128ecb = Aes128ecb(key=key, comp_mode=comp_mode)
+            text = ''.join(random.choice(string.printable) for _ in range(500))
+            encrypted_text = aes128ecb.encrypt_text(text)
+            self.assertEqual(encrypted_text, ''.join(aes128ecb.encrypt_text_stream(text)))
+            self.assertEqual(encrypted_text, ''.join(aes128ecb.encrypt_text_stream(text, chunk_blocks=7)))
+            if comp_mode:
+                self.assertEqual(aes128ecb.encrypted_length(text), len(encrypted_text))
+            else:
+                self.assertIsNone(aes128ecb.encrypted_length(text))
+            self.assertEqual(aes128ecb.decrypt_text(encrypted_text), ''.join(aes128ecb.decrypt_text_stream(encrypted_text)))
+
+    def test_Aes128ecb_codec(self):
+
+        # Same output as the original (device) codec, on known test vectors
+        key = 0x2b7e151628aed2a6abf7158809cf4f3c
+        vectors = {True: [('', ''),
+                          ('a', '105200521235329269394238216365057406552'),
+                          ('{"token": "3f9a", "msg": "Hello world!"}', '26849282168264825780688459962030278784229489351790329007733292960757617197173876489139698840842827490133439019709649&316462482060232553519246994615661424224')],
+                   False: [('', ''),
+                           ('a', 'azirxkUu6w3tp0hGd901fw'),
+                           ('{"token": "3f9a", "msg": "Hello world!"}', 'UI6sgmvGSNhXLIdGAo4eBQQq4VSihLg/sPulhtn6zSygnjKYFC24LIFG1wsIyJZjcA')]}
+        long_text_hashes = {True: '2a0ea4c9f2bb63d53880f5d772d7189f407677833d302c19e1f55abe1a11f914',
+                            False: 'c0a66e56556ae39586dd30eaad9458e0bc215c9dc26d73e1c5b4c16cce8cacb6'}
+        random.seed(1)
+        long_text = ''.join(chr(random.randint(32,126)) for _ in range(5000))
+        for comp_mode in [True, False]:
+            aes128ecb = Aes128ecb(key=key, comp_mode=comp_mode)
+            for text, encrypted_text in vectors[comp_mode]:
+                self.assertEqual(aes128ecb.encrypt_text(text), encrypted_text)
+                self.assertEqual(aes128ecb.decrypt_text(encrypted_text), text)
+            encrypted_text = aes128ecb.encrypt_text(long_text)
+            self.assertEqual(hashlib.sha256(encrypted_text.encode('utf-8')).hexdigest(), long_text_hashes[comp_mode])
+            self.assertEqual(aes128ecb.decrypt_text(encrypted_text), long_text.replace('&',''))
+
+    def test_Srsa(self):
+
+        # Key pair from two (Mersenne) primes
+        p, q = 2**89-1, 2**107-1
+        pubkey = p * q
+        privkey = multinv((p-1)*(q-1), 65537)
+
+        # Primes recovery
+        self.assertEqual(sorted(recover_primes(pubkey, privkey)), [p, q])
+        with self.assertRaises(ValueError):
+            Srsa(pubkey=pubkey, privkey=privkey, primes=(p, p))
+
+        # Same results with and without the CRT, and as the original pow3
+        srsa = Srsa(pubkey=pubkey, privkey=privkey)
+        srsa_crt = Srsa(pubkey=pubkey, privkey=privkey, primes=(p, q))
+        for _ in range(20):
+            chunk = random.getrandbits(128) % pubkey
+            self.assertEqual(srsa.encrypt_int(chunk), pow3(chunk, 65537, pubkey))
+            self.assertEqual(srsa.decrypt_int(chunk), pow3(chunk, privkey, pubkey))
+            self.assertEqual(srsa_crt.decrypt_int(chunk), srsa.decrypt_int(chunk))
+
+        # Encrypt (as the Things do) and decrypt back
+        text = str(random.getrandbits(128))
+        self.assertEqual(srsa_crt.decrypt_text(Srsa(pubkey=pubkey).encrypt_text(text)), text)
+
+    @skipUnless(aes_gcm_available, 'The cryptography package is not installed')
+    def test_Aes128gcm(self):
+
+        aes128gcm = Aes128gcm(key=random.getrandbits(128))
+        text = '{"token": "3f9a", "msg": "Hello world! \u00e8"}'
+
+        # Encrypt and decrypt back, with both framings
+        self.assertEqual(aes128gcm.decrypt_text(aes128gcm.encrypt_text(text)), text)
+        self.assertEqual(aes128gcm.decrypt_bytes(aes128gcm.encrypt_bytes(b'\x00\xff binary')), b'\x00\xff binary')
+
+        # Random nonces, and a fixed overhead (nonce and tag) instead of the comp_mode expansion
+        self.assertNotEqual(aes128gcm.encrypt_text(text), aes128gcm.encrypt_text(text))
+        self.assertEqual(len(aes128gcm.encrypt_bytes(text.encode('utf-8'))), len(text.encode('utf-8')) + 28)
+        self.assertLess(len(aes128gcm.encrypt_text(text)), len(Aes128ecb(key=aes128gcm.key, comp_mode=True).encrypt_text(text)))
+
+        # Tampered messages and wrong keys are detected
+        encrypted = bytearray(aes128gcm.encrypt_bytes(b'Hello world!'))
+        encrypted[15] ^= 1
+        with self.assertRaises(Exception):
+            aes128gcm.decrypt_bytes(bytes(encrypted))
+        with self.assertRaises(Exception):
+            Aes128gcm(key=aes128gcm.key+1).decrypt_text(aes128gcm.encrypt_text(text))
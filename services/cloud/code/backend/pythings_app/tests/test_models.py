@@ -1,10 +1,24 @@
+import os
 import json
+import shutil
+import tempfile
 import logging
 import random
+import hashlib
+from unittest import mock
+from datetime import timedelta
   
 from backend.pythings_app.tests.common import BaseAPITestCase
 from django.contrib.auth.models import User
-from backend.pythings_app.models import WorkerMessage, ManagementMessage, App, Thing, Pool, Settings, Profile, WorkerMessageHandler
+from django.conf import settings as django_settings
+from django.utils import timezone
+from backend.pythings_app.models import WorkerMessage, ManagementMessage, ManagementMessageHistory, Blob, File, Commit, App, Thing, Pool, Settings, Session, Rollout, Profile, WorkerMessageHandler
+from backend.pythings_app.helpers import expire_management_messages, purge_management_messages_history, start_rollout, get_rollout_app_version, advance_rollouts
+from backend.pythings_app.helpers import get_session_encrypter, invalidate_session_encrypter
+from backend.pythings_app.dist import DistIndex, DistFileChanged
+from backend.pythings_app.crypto_aes import Aes128ecb
+from backend.pythings_app.crypto_aes_gcm import Aes128gcm
+from backend.pythings_app.payloads import app_payloads_cache, get_app_payload, get_app_bundle, prerender_app_payloads
 from backend.pythings_app import apis_web_v1 as apis 
 
 # Logging
@@ -65,5 +79,170 @@ class ApiTests(BaseAPITestCase):
         # Test data (json field) behavior
         self.assertEqual(type(entries[0].data), str)        
         self.assertEqual(entries[0].data, string_data)
-        
-        
\ No newline at end of file
+
+
+    def test_ManagementMessage_expire(self):
+
+        # Create an already expired message, a live one and a received one
+        ManagementMessage.objects.create(aid='A1', tid='T1', data='expired', ttl=60, ts=timezone.now()-timedelta(seconds=120))
+        ManagementMessage.objects.create(aid='A1', tid='T1', data='live', ttl=60)
+        ManagementMessage.objects.create(aid='A1', tid='T1', data='received', status='Received')
+
+        # Expire
+        self.assertEqual(expire_management_messages(), 1)
+
+        # Only the live one is left in the queue, the others are in the history
+        self.assertEqual([entry.data for entry in ManagementMessage.objects.all()], ['live'])
+        self.assertEqual({entry.data: entry.status for entry in ManagementMessageHistory.objects.all()}, {'expired': 'Expired', 'received': 'Received'})
+
+        # Only the history older than the retention is purged
+        ManagementMessageHistory.objects.filter(data='expired').update(archived=timezone.now()-timedelta(seconds=django_settings.MANAGEMENT_MESSAGE_HISTORY_RETENTION+60))
+        self.assertEqual(purge_management_messages_history(), 1)
+        self.assertEqual([entry.data for entry in ManagementMessageHistory.objects.all()], ['received'])
+
+
+    def test_File_blob(self):
+
+        user = User.objects.create_user('testuser', password='testpass')
+        app = App.objects.create(aid='A1', name='Test App', user=user)
+
+        # Files with the same content share the same Blob
+        file1 = File.objects.create(name='worker_task.py', app=app, content='print(1)')
+        file2 = File.objects.create(name='management_task.py', app=app, content='print(1)')
+        self.assertEqual(Blob.objects.count(), 1)
+        self.assertEqual(file1.hash, hashlib.sha256(b'print(1)').hexdigest())
+        self.assertEqual(File.objects.get(id=file2.id).content, 'print(1)')
+
+        # Changing the content of a file does not affect the others
+        file2.content = 'print(2)'
+        file2.save()
+        self.assertEqual(Blob.objects.count(), 2)
+        self.assertEqual(File.objects.get(id=file1.id).content, 'print(1)')
+        self.assertEqual(File.objects.get(id=file2.id).content, 'print(2)')
+
+
+    def test_app_payloads(self):
+
+        user = User.objects.create_user('testuser', password='testpass')
+        app = App.objects.create(aid='A1', name='Test App', user=user)
+        commit = Commit.objects.create(app=app, cid='123')
+        commit.files.add(File.objects.create(name='worker_task.py', app=app, content='print(1)', committed=True))
+        commit.files.add(File.objects.create(name='management_task.py', app=app, content='print(2)', committed=True))
+
+        # Pre-render
+        app_payloads_cache.clear()
+        prerender_app_payloads(commit)
+        self.assertEqual(len(app_payloads_cache), 6)
+        self.assertIn((commit.id, None, 'bundle'), app_payloads_cache)
+
+        # Check payloads
+        self.assertEqual(get_app_payload(commit, 'worker_task.py').content,
+                         'import logger\ntry:\n    import sensors\nexcept ImportError:\n    pass\n\nprint(1)\nversion=\'123\'')
+        self.assertEqual(get_app_payload(commit, 'management_task.py').content, 'import logger\nprint(2)\nversion=\'123\'')
+        self.assertEqual(get_app_payload(commit, 'management_task.py', prologue=False).content, 'print(2)\nversion=\'123\'')
+        self.assertEqual(get_app_payload(commit).content, 'import logger\nprint(1)print(2)\nversion=\'123\'')
+        self.assertEqual(len(app_payloads_cache), 6)
+
+        # The bundle is also stored, and another process (with an empty cache) loads it without rendering it again
+        commit = Commit.objects.get(id=commit.id)
+        self.assertEqual(commit.bundle.content, get_app_bundle(commit).content)
+        app_payloads_cache.clear()
+        with mock.patch('backend.pythings_app.payloads.render_app_bundle', side_effect=AssertionError('Rendered again')):
+            self.assertEqual(get_app_bundle(commit).content, commit.bundle.content)
+
+
+    def test_DistIndex(self):
+
+        # Create a dist tree
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        os.makedirs(os.path.join(root, 'v1.0', 'esp8266'))
+        with open(os.path.join(root, 'v1.0', 'esp8266', 'files.txt'), 'w') as f:
+            f.write('1:11:version.py\n2:5:main.py\n')
+        with open(os.path.join(root, 'v1.0', 'esp8266', 'version.py'), 'w') as f:
+            f.write("version='1'")
+        with open(os.path.join(root, 'v1.0', 'esp8266', 'main.py'), 'w') as f:
+            f.write('')
+
+        # Load and lookup
+        dist_index = DistIndex(root)
+        self.assertEqual(dist_index.get_tree('v1.0', 'esp8266').manifest, {'version.py': '11', 'main.py': '5'})
+        self.assertEqual(dist_index.get_file('v1.0', 'esp8266', 'version.py').payload.content, "version='1'")
+        self.assertEqual(dist_index.get_file('v1.0', 'esp8266', 'main.py').payload.content, '')
+        self.assertEqual(dist_index.get_file('v1.0', 'esp8266', '../esp8266/version.py'), None)
+        self.assertEqual(dist_index.get_tree('v1.0', 'esp32'), None)
+
+        # Add a new platform and reload
+        os.makedirs(os.path.join(root, 'v1.0', 'esp32'))
+        with open(os.path.join(root, 'v1.0', 'esp32', 'files.txt'), 'w') as f:
+            f.write('1:11:version.py\n')
+        dist_index.load()
+        self.assertEqual(dist_index.get_tree('v1.0', 'esp32').manifest, {'version.py': '11'})
+
+        # Rewrite a file in place (same size): it is detected as changed, and picked up on reload
+        dist_file = dist_index.get_file('v1.0', 'esp8266', 'version.py')
+        with open(dist_file.path, 'w') as f:
+            f.write("version='2'")
+        os.utime(dist_file.path, ns=(0, os.stat(dist_file.path).st_mtime_ns + 1000000000))
+        with self.assertRaises(DistFileChanged):
+            dist_file.read()
+        dist_index.load()
+        self.assertNotEqual(dist_index.get_file('v1.0', 'esp8266', 'version.py').validator, dist_file.validator)
+        self.assertEqual(dist_index.get_file('v1.0', 'esp8266', 'version.py').payload.content, "version='2'")
+
+
+    def test_Rollout(self):
+
+        user = User.objects.create_user('testuser', password='testpass')
+        app = App.objects.create(aid='A1', name='Test App', user=user)
+        Commit.objects.create(app=app, cid='2')
+        settings = Settings.objects.create(pythings_version='v0.1', app_version='2', management_interval='60', worker_interval='60')
+        pool = Pool.objects.create(app=app, settings=settings)
+        things = [Thing.objects.create(tid='T{}'.format(i), app=app, pool=pool) for i in range(100)]
+
+        # Start the rollout: only some Things get the new version
+        rollout = start_rollout(pool, '1', '2')
+        versions = [get_rollout_app_version(thing, '2') for thing in things]
+        self.assertTrue(0 < versions.count('2') < 20)
+        self.assertEqual(set(versions), set(['1', '2']))
+
+        # Things already running the new version keep it
+        self.assertEqual(set(get_rollout_app_version(thing, '2', running_version='2') for thing in things), set(['2']))
+
+        # Advance: more Things get the new version, and the ones that already had it keep it
+        rollout.updated = timezone.now() - timedelta(hours=1)
+        rollout.save()
+        self.assertEqual(advance_rollouts(), 1)
+        self.assertEqual(Rollout.objects.get(id=rollout.id).percentage, 15)
+        new_versions = [get_rollout_app_version(thing, '2') for thing in things]
+        self.assertTrue(new_versions.count('2') > versions.count('2'))
+        self.assertTrue(all(new_version == '2' for version, new_version in zip(versions, new_versions) if version == '2'))
+
+        # Errors on the new version pause the rollout
+        for thing in things[0:10]:
+            Session.objects.create(token=thing.tid, thing=thing, pool=pool, app_version='2', last_worker_status='KO: error')
+        for thing in things[10:20]:
+            Session.objects.create(token=thing.tid, thing=thing, pool=pool, app_version='1', last_worker_status='OK')
+        Rollout.objects.filter(id=rollout.id).update(updated=timezone.now() - timedelta(hours=1))
+        self.assertEqual(advance_rollouts(), 0)
+        self.assertEqual(Rollout.objects.get(id=rollout.id).status, 'Paused')
+
+        # Small pools do not need a rollout
+        self.assertEqual(start_rollout(Pool.objects.create(app=app, settings=settings), '1', '2'), None)
+
+
+    def test_session_encrypter(self):
+
+        # The same encrypter is reused for the same session, until invalidated
+        encrypter = get_session_encrypter('token1', '1234567890')
+        self.assertIs(get_session_encrypter('token1', '1234567890'), encrypter)
+        self.assertIsNot(get_session_encrypter('token2', '1234567890'), encrypter)
+        invalidate_session_encrypter('token1')
+        self.assertIsNot(get_session_encrypter('token1', '1234567890'), encrypter)
+
+        # A different key for the same token gets a new encrypter
+        self.assertEqual(get_session_encrypter('token1', '987654321').key, 987654321)
+
+        # The session cipher depends on the key encryption
+        self.assertIsInstance(get_session_encrypter('token3', '1234567890', 'srsa1'), Aes128ecb)
+        self.assertIsInstance(get_session_encrypter('token3', '1234567890', 'srsa1-aes128gcm'), Aes128gcm)
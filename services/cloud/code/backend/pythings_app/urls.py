@@ -55,6 +55,9 @@ urlpatterns = [
     url(r'^api/web/v1/msg/management/new$', apis_web_v1.api_msg_management_new.as_view(), name='api_web_msg_management_new'),
     url(r'^api/web/v1/msg/management/get$', apis_web_v1.api_msg_management_get.as_view(), name='api_web_msg_management_get'),
 
+    # Remote shell
+    url(r'^api/web/v1/shell/history$', apis_web_v1.api_shell_history.as_view(), name='api_web_shell_history'),
+
 
     #===========================
     #  APIs (things) v1.x.x 
@@ -8,6 +8,7 @@ import datetime
 # Django imports
 from django.shortcuts import render
 from django.http import HttpResponse
+from django.utils import timezone
 from django.http import HttpResponseRedirect
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
@@ -21,9 +22,10 @@ from ..common.utils import booleanize, format_exception, random_username
 from ..common.exceptions import ErrorMessage
 from ..common.time import timezonize, s_from_dt, dt, dt_from_s
 from ..base_app.models import LoginToken
-from .models import App, Thing, Session, Profile, WorkerMessageHandler, MessageCounter, ManagementMessage, WorkerMessage, Pool, File, Commit
+from .models import App, Thing, Session, Profile, WorkerMessageHandler, MessageCounter, ManagementMessage, ManagementMessageHistory, WorkerMessage, Pool, File, Commit
 from .helpers import create_app as create_app_helper
-from .helpers import create_none_app, get_total_messages, get_total_devices, get_timezone_from_request
+from .payloads import prerender_app_payloads
+from .helpers import create_none_app, get_total_messages, get_total_devices, get_timezone_from_request, get_management_messages, get_shell_messages, notify_shell, touch_user_activity, start_rollout, get_rollout
 
 # Setup logging
 logger = logging.getLogger(__name__)
@@ -602,6 +604,7 @@ def dashboard_app(request):
             logger.info('Removing messages for TID "{}" '.format(thing.tid))
             WorkerMessage.objects.filter(aid=thing.app.aid, tid=thing.tid).delete()
             ManagementMessage.objects.filter(aid=thing.app.aid, tid=thing.tid).delete()
+            ManagementMessageHistory.objects.filter(aid=thing.app.aid, tid=thing.tid).delete()
     
         # 2) Save Settings which are indirectly attached to the App's pools
         setting_objects_to_delete=[]
@@ -682,6 +685,10 @@ def dashboard_app(request):
                 int(value)
                 selected_pool.settings.management_interval = value
                 selected_pool.settings.save()
+            elif edit in ['management_interval_min', 'management_interval_max'] and value:
+                # Bounds for the adaptive management interval ("none" to disable)
+                setattr(selected_pool.settings, edit, None if value.lower()=='none' else int(value))
+                selected_pool.settings.save()
             elif edit=='worker_interval' and value:
                 try:
                     int(value)
@@ -713,6 +720,7 @@ def dashboard_app(request):
                 app.name = value
                 app.save()
             elif edit=='app_version':
+                previous_app_version = selected_pool.settings.app_version
                 if use_latest_app:
                     if selected_pool.development:
                         commit = Commit.objects.filter(app=app).latest('ts')
@@ -720,6 +728,7 @@ def dashboard_app(request):
                         commit = Commit.objects.filter(app=app,tag__isnull=False).latest('ts')
                     selected_pool.settings.app_version = commit.cid
                     selected_pool.settings.save()
+                    start_rollout(selected_pool, previous_app_version, commit.cid)
                 elif value:
                     # Validate
                     if len(value) >5 and value[0:4]==('tag:'):
@@ -730,8 +739,26 @@ def dashboard_app(request):
                     # Update  
                     selected_pool.settings.app_version = commit.cid
                     selected_pool.settings.save()
+                    start_rollout(selected_pool, previous_app_version, commit.cid)
                 else:
                     pass 
+            elif edit=='rollout' and value:
+                # Resume, complete or cancel the rollout in progress
+                rollout = get_rollout(selected_pool)
+                if not rollout or value not in ['resume', 'complete', 'cancel']:
+                    raise Exception()
+                if value == 'resume':
+                    rollout.status = 'Running'
+                elif value == 'complete':
+                    rollout.status = 'Completed'
+                    rollout.percentage = 100
+                else:
+                    # Back to the previous version
+                    rollout.status = 'Cancelled'
+                    selected_pool.settings.app_version = rollout.from_version
+                    selected_pool.settings.save()
+                rollout.updated = timezone.now()
+                rollout.save()
                 
             # Generic property
             else:
@@ -752,6 +779,9 @@ def dashboard_app(request):
      
     # Get latest version
     data['app_latest_commit'] = Commit.objects.filter(app=app).latest('ts')
+
+    # Get the rollout in progress, if any
+    data['rollout'] = get_rollout(selected_pool)
     data['app_latest_commit_ts'] = str(data['app_latest_commit'].ts.astimezone(timezonize(get_timezone_from_request(request)))).split('.')[0]
    
     # Enumerate things for this App and pool
@@ -843,6 +873,7 @@ def dashboard_thing(request):
     data={}
     data['user']  = request.user
     data['profile'] = Profile.objects.get(user=request.user)
+    touch_user_activity(request.user)
     data['apps']  = {}
     data['metrics'] = {}
     data['timeseries'] = {}
@@ -972,6 +1003,7 @@ def dashboard_thing(request):
         else:
             try: 
                 ManagementMessage.objects.filter(tid=thing.tid).delete()
+                ManagementMessageHistory.objects.filter(tid=thing.tid).delete()
             except Exception as e:
                 logger.error('Error when deleting management messages for tid "{}"'.format(thing.tid))
             thing.delete()
@@ -1014,7 +1046,7 @@ def dashboard_thing(request):
     # Get last management messages
     last_management_msgs = []
     try: 
-        last_management_msgs = ManagementMessage.objects.filter(tid=thing.tid, aid=thing.app.aid).order_by('ts')[:3].reverse()
+        last_management_msgs = list(reversed(get_management_messages(last=3, tid=thing.tid, aid=thing.app.aid)))
         for msg in last_management_msgs:
             msg.ts = str(msg.ts.astimezone(profile_timezone)).split('.')[0]
         
@@ -1496,14 +1528,12 @@ def dashboard_thing_messages(request):
         
         if new_msg and generated_uuid:
             # Does a message already exists?
-            try:
-                ManagementMessage.objects.get(tid=thing.tid, uuid=generated_uuid)
-            except:
+            if not get_management_messages(tid=thing.tid, uuid=generated_uuid):
                 ManagementMessage.objects.create(aid=thing.app.aid, tid=thing.tid, data=new_msg, uuid=generated_uuid)
      
         # Load management messages
         try:
-            for msg in ManagementMessage.objects.filter(tid=thing.tid, aid=thing.app.aid, type='APP').order_by('-ts')[start:end]:
+            for msg in list(reversed(get_management_messages(last=end, tid=thing.tid, aid=thing.app.aid, type='APP')))[start:end]:
                 msg.ts = str(msg.ts.astimezone(timezonize(get_timezone_from_request(request)))).split('.')[0]
                 data['messages'].append(msg)
         except:
@@ -1532,6 +1562,7 @@ def dashboard_thing_shell(request):
     data={}
     data['user']  = request.user
     data['profile'] = Profile.objects.get(user=request.user)
+    touch_user_activity(request.user)
 
     intaid = request.GET.get('intaid',None)
     if not intaid:
@@ -1575,13 +1606,17 @@ def dashboard_thing_shell(request):
     if new_msg and generated_uuid:
         
         # Does a message already exists?
-        try:
-            ManagementMessage.objects.get(tid=thing.tid, uuid=generated_uuid)
-        except:
-            ManagementMessage.objects.create(aid=thing.app.aid, tid=thing.tid, data=new_msg, uuid=generated_uuid, type='CMD', thing=thing)
+        if not get_management_messages(tid=thing.tid, uuid=generated_uuid):
+            notify_shell(ManagementMessage.objects.create(aid=thing.app.aid, tid=thing.tid, data=new_msg, uuid=generated_uuid, type='CMD', thing=thing))
  
-    # Load CMD management messages (filter by Thing as they are linked to the thing and not a specific app)
-    for msg in ManagementMessage.objects.filter(thing=thing, type='CMD').order_by('ts'):
+    # Load the last CMD management messages (filter by Thing as they are linked to the thing and not a specific app).
+    # Newer ones are then pushed (long polling) or polled incrementally from the cursor.
+    shell_messages = get_shell_messages(thing, last=settings.SHELL_SCROLLBACK)
+    data['cursor'] = s_from_dt(shell_messages[-1].ts) if shell_messages else 0
+    data['longpoll_wait'] = settings.SHELL_LONGPOLL_MAX_WAIT
+    data['poll_interval_ms'] = settings.SHELL_POLL_INTERVAL*1000
+    data['idle_poll_interval_ms'] = settings.SHELL_IDLE_POLL_INTERVAL*1000
+    for msg in shell_messages:
         msg.ts = str(msg.ts.astimezone(timezonize(get_timezone_from_request(request)))).split('.')[0]
         if msg.reply:
             msg.reply_clean = msg.reply.rstrip('\n')
@@ -1751,6 +1786,9 @@ def dashboard_app_code_editor(request, embed=False):
 
             newcommit.valid=True
             newcommit.save()
+
+            # Pre-render the payloads for the Things
+            prerender_app_payloads(newcommit)
             
             # Reload uncommitted files
             uncommitted_files = File.objects.filter(app=app,committed=False)
@@ -1768,8 +1806,10 @@ def dashboard_app_code_editor(request, embed=False):
              
                 # Update version only on development if set so
                 if pool.use_latest_app_version and pool.development:
+                    previous_app_version = pool.settings.app_version
                     pool.settings.app_version = commit.cid
                     pool.settings.save() 
+                    start_rollout(pool, previous_app_version, commit.cid)
          
                     # Also, for each thing in the pool with custom settings, update the version
                     for thing in Thing.objects.filter(pool=pool, use_custom_settings=True):
@@ -1789,8 +1829,10 @@ def dashboard_app_code_editor(request, embed=False):
 
             # Update version only on staging if set so
             if pool.use_latest_app_version and pool.staging:
+                previous_app_version = pool.settings.app_version
                 pool.settings.app_version = commit.cid
                 pool.settings.save() 
+                start_rollout(pool, previous_app_version, commit.cid)
      
                 # Also, for each thing in the pool with custom settings, update the version
                 for thing in Thing.objects.filter(pool=pool, use_custom_settings=True):
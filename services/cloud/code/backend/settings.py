@@ -206,6 +206,77 @@ OS_VERSIONS.reverse()
 # Default timeout for PythingsOS API calls before declaring timeout
 CONTACT_TIMEOUT_TOLERANCE = 60
 
+# Management messages status API: maximum mids per request, maximum wait time and polling interval (seconds).
+# Waiting holds a uWSGI worker thread, hence it is kept short: clients wanting longer waits just repeat the request.
+MANAGEMENT_MESSAGE_MAX_MIDS = 1000
+MANAGEMENT_MESSAGE_MAX_WAIT = 5
+MANAGEMENT_MESSAGE_WAIT_POLL = 0.5
+
+# Default management messages TTL (seconds) before being expired if not delivered or replied
+MANAGEMENT_MESSAGE_DEFAULT_TTL = int(os.environ.get('MANAGEMENT_MESSAGE_DEFAULT_TTL', 7*24*60*60))
+
+# Retention (seconds) of the management messages history, purged by the pythings_app_expire command
+MANAGEMENT_MESSAGE_HISTORY_RETENTION = int(os.environ.get('MANAGEMENT_MESSAGE_HISTORY_RETENTION', 30*24*60*60))
+
+# Remote shell updates are pushed via long polling: each request waits at most SHELL_LONGPOLL_MAX_WAIT seconds for new
+# messages, and at most SHELL_LONGPOLL_MAX_WAITERS threads per uWSGI process wait at once (keep it below UWSGI_THREADS).
+# Requests that cannot wait fall back to polling, every SHELL_POLL_INTERVAL seconds while waiting for replies and every
+# SHELL_IDLE_POLL_INTERVAL seconds otherwise.
+SHELL_LONGPOLL_MAX_WAIT = 20
+SHELL_LONGPOLL_MAX_WAITERS = int(os.environ.get('SHELL_LONGPOLL_MAX_WAITERS', 1))
+SHELL_POLL_INTERVAL = 2
+SHELL_IDLE_POLL_INTERVAL = 10
+
+# Remote shell scrollback (maximum number of messages loaded at once)
+SHELL_SCROLLBACK = 100
+
+# Adaptive management polling: a Thing is considered active if it had management messages or its user had
+# dashboard activity in this time window (seconds), otherwise its polling interval is backed off.
+MANAGEMENT_POLL_ACTIVE_WINDOW = 300
+
+# Per-process cache of the last activity of the Things and users, for the management poll hints
+POLL_ACTIVITY_CACHE_SIZE = 100000
+POLL_ACTIVITY_CACHE_TTL = 30
+
+# Maximum memory used (per process) by the cache of pre-rendered App code payloads (bytes)
+PAYLOADS_CACHE_MAX_BYTES = int(os.environ.get('PAYLOADS_CACHE_MAX_BYTES', 64*1024*1024))
+
+# PythingsOS dist trees root, and how often (seconds) its in-process index checks them for changes (in the background)
+PYTHINGSOS_DIST_ROOT = os.environ.get('PYTHINGSOS_DIST_ROOT', '/opt/PythingsOS-dist/PythingsOS')
+DIST_INDEX_CHECK_INTERVAL = 10
+
+# Unencrypted PythingsOS downloads can be handed off to the web server using an X-Sendfile-like header (i.e. 'X-Sendfile'
+# or 'X-Accel-Redirect'), with the given prefix prepended to the file path. If not set, they are sent using sendfile.
+SENDFILE_HEADER = os.environ.get('SENDFILE_HEADER', None)
+SENDFILE_PREFIX = os.environ.get('SENDFILE_PREFIX', '')
+
+# Staged rollouts of new App versions (pools with less Things than ROLLOUT_MIN_THINGS switch at once). The exposed
+# percentage grows by ROLLOUT_STEP_PERCENTAGE every ROLLOUT_STEP_INTERVAL seconds (as advanced by the scheduler), within
+# a global downloads budget, and a rollout pauses if the error rate of the new version exceeds the old one by more than given.
+ROLLOUT_MIN_THINGS = 10
+ROLLOUT_INITIAL_PERCENTAGE = 5
+ROLLOUT_STEP_PERCENTAGE = 10
+ROLLOUT_STEP_INTERVAL = 300
+ROLLOUT_MAX_DOWNLOADS_PER_S = int(os.environ.get('ROLLOUT_MAX_DOWNLOADS_PER_S', 50))
+ROLLOUT_MAX_ERROR_RATE_INCREASE = 0.1
+ROLLOUT_MIN_SAMPLE = 5
+
+# Maximum number of sessions (per process) whose payload encrypter (expanded AES key) is kept in memory
+SESSION_ENCRYPTERS_CACHE_SIZE = 10000
+
+# Encrypted responses bigger than this (in chars) are streamed, encrypting this many AES blocks at a time
+STREAMING_RESPONSE_MIN_SIZE = 64*1024
+STREAMING_RESPONSE_CHUNK_BLOCKS = 1024
+
+# Maximum memory used (per process) by the cache of encrypted payloads (bytes), and how long (seconds) they are kept,
+# so that retried and duplicated downloads of the same content by the same session do not have to encrypt it again
+ENCRYPTED_PAYLOADS_CACHE_MAX_BYTES = int(os.environ.get('ENCRYPTED_PAYLOADS_CACHE_MAX_BYTES', 32*1024*1024))
+ENCRYPTED_PAYLOADS_CACHE_TTL = 300
+
+# Cloud RSA key pair for the Things preregistration (loaded once per process)
+RSA_PUBKEY_FILE = os.environ.get('RSA_PUBKEY_FILE', '../pubkey.key')
+RSA_PRIVKEY_FILE = os.environ.get('RSA_PRIVKEY_FILE', '../privkey.key')
+
 # Email settings
 EMAIL_BACKEND = os.environ.get('BACKEND_EMAIL_TYPE', 'django.core.mail.backends.smtp.EmailBackend')
 EMAIL_HOST = os.environ.get('BACKEND_EMAIL_HOST', None)
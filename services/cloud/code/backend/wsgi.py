@@ -14,3 +14,15 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
 
 application = get_wsgi_application()
+
+# Preload the PythingsOS dist index (before the workers are forked, if any)
+from backend.pythings_app.dist import dist_index
+dist_index.load()
+
+# Preload the preregistration keys
+import logging
+from backend.pythings_app.helpers import get_srsa
+try:
+    get_srsa()
+except (IOError, ValueError) as e:
+    logging.getLogger(__name__).error('Cannot load the preregistration keys: {}'.format(e))
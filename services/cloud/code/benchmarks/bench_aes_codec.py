@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+'''Throughput benchmark of the Aes128ecb text codec (encrypt_text and decrypt_text), on 1 KB, 20 KB and 200 KB payloads.
+Run from the "code" directory with: python benchmarks/bench_aes_codec.py [python|native]'''
+
+import os
+import sys
+import time
+import random
+import string
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from backend.pythings_app.crypto_aes import Aes128ecb
+
+SIZES = [1024, 20*1024, 200*1024]
+MIN_TIME = 1.0
+
+def bench(function, argument):
+    runs = 0
+    start = time.time()
+    while True:
+        function(argument)
+        runs += 1
+        elapsed = time.time() - start
+        if elapsed > MIN_TIME:
+            return elapsed/runs
+
+if __name__ == '__main__':
+    backend = sys.argv[1] if len(sys.argv) > 1 else None
+    random.seed(42)
+    key = random.getrandbits(128)
+    for comp_mode in [False, True]:
+        aes128ecb = Aes128ecb(key=key, comp_mode=comp_mode, backend=backend)
+        for size in SIZES:
+            text = ''.join(random.choice(string.ascii_letters + string.digits + ' {}":,') for _ in range(size))
+            encrypted_text = aes128ecb.encrypt_text(text)
+            encrypt_s = bench(aes128ecb.encrypt_text, text)
+            decrypt_s = bench(aes128ecb.decrypt_text, encrypted_text)
+            print('{:<9} comp_mode={:<5} {:>4} KB   encrypt: {:>8.2f} ms ({:>6.2f} MB/s)   decrypt: {:>8.2f} ms ({:>6.2f} MB/s)'.format(
+                  type(aes128ecb.aes).__name__.split('_')[1], str(comp_mode), size//1024,
+                  encrypt_s*1000, size/encrypt_s/1e6, decrypt_s*1000, size/decrypt_s/1e6))
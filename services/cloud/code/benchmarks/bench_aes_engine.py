@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+'''Microbenchmark of the AES-128 engines (single 16-bytes blocks, as integers).
+Run from the "code" directory with: python benchmarks/bench_aes_engine.py'''
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from backend.pythings_app.crypto_engine_aes128ecb import Aes128ecb_engine, Aes128ecb_ttable_engine
+from backend.pythings_app.crypto_engine_aes128ecb_native import Aes128ecb_native_engine, available as native_available
+
+BLOCKS = 2000
+
+def bench(engine_class, key, blocks):
+    engine = engine_class(key)
+    start = time.time()
+    for block in blocks:
+        engine.encrypt(block)
+    encrypt_s = time.time() - start
+    start = time.time()
+    for block in blocks:
+        engine.decrypt(block)
+    decrypt_s = time.time() - start
+    return len(blocks)/encrypt_s, len(blocks)/decrypt_s
+
+if __name__ == '__main__':
+    random.seed(42)
+    key = random.getrandbits(128)
+    blocks = [random.getrandbits(128) for _ in range(BLOCKS)]
+    results = {}
+    for engine_class in [Aes128ecb_engine, Aes128ecb_ttable_engine] + ([Aes128ecb_native_engine] if native_available else []):
+        results[engine_class.__name__] = bench(engine_class, key, blocks)
+        print('{:<25} encrypt: {:>9.0f} blocks/s   decrypt: {:>9.0f} blocks/s'.format(engine_class.__name__, *results[engine_class.__name__]))
+    print('Speedup: encrypt x{:.1f}, decrypt x{:.1f}'.format(results['Aes128ecb_ttable_engine'][0]/results['Aes128ecb_engine'][0],
+                                                        results['Aes128ecb_ttable_engine'][1]/results['Aes128ecb_engine'][1]))
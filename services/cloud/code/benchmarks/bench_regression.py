@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+'''Crypto performance regression suite: Aes128ecb (comp_mode on and off), Srsa and the encrypted Thing API round trip
+(the device encrypts a request, the Cloud decrypts it and encrypts the response as ThingAPI.post() and response() do,
+and the device decrypts it back), on 1 KB, 20 KB and 200 KB payloads. Does not require Django nor Docker.
+
+Run from the "code" directory with:
+
+    python benchmarks/bench_regression.py [--backend python|native] [--threshold 0.25] [--update]
+
+Results (ops/s and bytes/s) are compared with the baseline in benchmarks/baseline.json, for the same AES backend, and
+the run fails (exit code 1) if any case got slower than the baseline by more than the threshold. Use --update to
+store the results as the new baseline (i.e. on a new reference machine, or after an accepted change).'''
+
+import os
+import sys
+import json
+import time
+import random
+import string
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from backend.pythings_app.crypto_aes import Aes128ecb
+from backend.pythings_app.crypto_rsa import Srsa, recover_primes
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+SIZES = [1024, 20*1024, 200*1024]
+MIN_TIME = 0.5
+
+
+def bench(function, argument, size):
+    '''Run a function for at least MIN_TIME seconds, returning ops/s and bytes/s'''
+    function(argument)
+    runs = 0
+    start = time.time()
+    while True:
+        function(argument)
+        runs += 1
+        elapsed = time.time() - start
+        if elapsed > MIN_TIME:
+            return {'ops_s': runs/elapsed, 'bytes_s': runs*size/elapsed}
+
+
+def random_text(size):
+    return ''.join(random.choice(string.ascii_letters + string.digits + ' {}":,') for _ in range(size))
+
+
+def get_cases(backend):
+    '''Get the benchmark cases, as name -> (function, argument, size in bytes)'''
+    random.seed(42)
+    cases = {}
+
+    # AES, with and without comp_mode
+    key = random.getrandbits(128)
+    for comp_mode in [True, False]:
+        aes128ecb = Aes128ecb(key=key, comp_mode=comp_mode, backend=backend)
+        for size in SIZES:
+            text = random_text(size)
+            name = 'aes128ecb_{}_{}k'.format('comp' if comp_mode else 'b64', size//1024)
+            cases[name+'_encrypt'] = (aes128ecb.encrypt_text, text, size)
+            cases[name+'_decrypt'] = (aes128ecb.decrypt_text, aes128ecb.encrypt_text(text), size)
+
+    # Simple RSA, as for the preregistration (the key of the session, encrypted by the device)
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'pubkey-dev.key')) as f:
+        pubkey = int(f.read())
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'privkey-dev.key')) as f:
+        privkey = int(f.read())
+    session_key = str(random.getrandbits(128))
+    srsa = Srsa(pubkey=pubkey, privkey=privkey, primes=recover_primes(pubkey, privkey))
+    cases['srsa_encrypt_key'] = (srsa.encrypt_text, session_key, len(session_key))
+    cases['srsa_decrypt_key'] = (srsa.decrypt_text, srsa.encrypt_text(session_key), len(session_key))
+
+    # Encrypted Thing API round trip
+    device = Aes128ecb(key=key, comp_mode=True, backend=backend)
+    cloud = Aes128ecb(key=key, comp_mode=True, backend=backend)
+    def round_trip(request):
+        data = json.loads(cloud.decrypt_text(device.encrypt_text(request)))
+        return device.decrypt_text(cloud.encrypt_text(json.dumps(data)))
+    for size in SIZES:
+        request = json.dumps({'token': 'a1b2c3d4', 'msg': random_text(size)})
+        cases['roundtrip_{}k'.format(size//1024)] = (round_trip, request, len(request))
+
+    return cases
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Crypto performance regression suite')
+    parser.add_argument('--backend', default='native', help='AES backend (python or native)')
+    parser.add_argument('--threshold', type=float, default=0.25, help='Maximum slowdown with respect to the baseline (0.25 = 25%%)')
+    parser.add_argument('--update', action='store_true', help='Store the results as the new baseline')
+    args = parser.parse_args()
+
+    try:
+        with open(BASELINE_FILE) as f:
+            baselines = json.load(f)
+    except IOError:
+        baselines = {}
+    baseline = baselines.get(args.backend, {})
+
+    results = {}
+    regressions = []
+    for name, (function, argument, size) in sorted(get_cases(args.backend).items()):
+        results[name] = bench(function, argument, size)
+        line = '{:<30} {:>10.1f} ops/s {:>8.2f} MB/s'.format(name, results[name]['ops_s'], results[name]['bytes_s']/1e6)
+        if name in baseline:
+            change = results[name]['ops_s']/baseline[name]['ops_s'] - 1
+            line += '   {:>+7.1%} vs baseline'.format(change)
+            if change < -args.threshold:
+                line += '   REGRESSION'
+                regressions.append(name)
+        print(line)
+
+    if args.update:
+        baselines[args.backend] = {name: {key: round(value, 1) for key, value in result.items()} for name, result in results.items()}
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Baseline updated for the "{}" backend'.format(args.backend))
+    elif regressions:
+        print('Performance regressions (more than {:.0%} slower): {}'.format(args.threshold, ', '.join(regressions)))
+        sys.exit(1)
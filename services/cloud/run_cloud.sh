@@ -58,9 +58,13 @@ else
           --module=backend.wsgi \
           --env DJANGO_SETTINGS_MODULE=backend.settings \
           --master --pidfile=/tmp/project-master.pid \
+          --processes ${UWSGI_PROCESSES:-4} \
+          --threads ${UWSGI_THREADS:-2} \
+          --enable-threads \
           --socket=127.0.0.1:49152 \
           --static-map /static=/pythings/static \
           --static-safe /opt/code \
+          --offload-threads 2 \
           --http :8080 \
           --disable-logging 2>> /var/log/cloud/backend.log
 fi
@@ -0,0 +1,32 @@
+#!/bin/bash
+
+DATE=$(date)
+
+echo ""
+echo "==================================================="
+echo "  Starting Scheduler @ $DATE"
+echo "==================================================="
+echo ""
+
+# Load env
+source /env.sh
+
+# Database conf
+source /db_conf.sh
+
+# Stay quiet
+export PYTHONWARNINGS=ignore
+
+# To Python3 unbuffered. P.s. "python3 -u" does not work..
+export PYTHONUNBUFFERED=on
+
+# Move to the code dir
+cd /opt/code
+
+# Run the periodic management commands forever (a failed run is just retried at the next round)
+echo "Now running the periodic tasks every ${SCHEDULER_INTERVAL:-60}s and logging in /var/log/cloud/scheduler.log."
+while true; do
+    python3 manage.py pythings_app_expire >> /var/log/cloud/scheduler.log 2>&1
+    python3 manage.py pythings_app_rollouts >> /var/log/cloud/scheduler.log 2>&1
+    sleep ${SCHEDULER_INTERVAL:-60}
+done